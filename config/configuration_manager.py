@@ -29,6 +29,11 @@ class SystemConfig:
     recognition_threshold: float
     secret_key: str
     debug: bool
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
 
 
 class ConfigurationManager:
@@ -43,6 +48,7 @@ class ConfigurationManager:
         """
         self._config = None
         self._config_file = config_file or "config.ini"
+        self._config_parser = None
         self._load_configuration()
     
     def _load_configuration(self) -> None:
@@ -63,6 +69,13 @@ class ConfigurationManager:
         else:
             logger.warning(f"Configuration file {config_file_path} not found, using defaults")
         
+        self._config_parser = config_parser
+        self._build_configuration()
+    
+    def _build_configuration(self) -> None:
+        """Build and validate configuration from the environment and parsed config file"""
+        config_parser = self._config_parser
+        
         # Build configuration with precedence: env vars > config file > defaults
         self._config = SystemConfig(
             database_url=self._get_config_value(
@@ -134,6 +147,41 @@ class ConfigurationManager:
                 "app",
                 "debug",
                 "False"
+            ).lower() == "true",
+            db_pool_size=int(self._get_config_value(
+                "DB_POOL_SIZE",
+                config_parser,
+                "database",
+                "pool_size",
+                "10"
+            )),
+            db_max_overflow=int(self._get_config_value(
+                "DB_MAX_OVERFLOW",
+                config_parser,
+                "database",
+                "max_overflow",
+                "20"
+            )),
+            db_pool_timeout=int(self._get_config_value(
+                "DB_POOL_TIMEOUT",
+                config_parser,
+                "database",
+                "pool_timeout",
+                "30"
+            )),
+            db_pool_recycle=int(self._get_config_value(
+                "DB_POOL_RECYCLE",
+                config_parser,
+                "database",
+                "pool_recycle",
+                "1800"
+            )),
+            db_pool_pre_ping=self._get_config_value(
+                "DB_POOL_PRE_PING",
+                config_parser,
+                "database",
+                "pool_pre_ping",
+                "True"
             ).lower() == "true"
         )
         
@@ -201,6 +249,13 @@ class ConfigurationManager:
         if not (0.0 <= self._config.recognition_threshold <= 1.0):
             errors.append("recognition_threshold must be between 0.0 and 1.0")
         
+        # Validate connection pool settings
+        if self._config.db_pool_size <= 0:
+            errors.append("db_pool_size must be positive")
+        
+        if self._config.db_max_overflow < 0:
+            errors.append("db_max_overflow must not be negative")
+        
         # Validate file types
         if not self._config.allowed_file_types:
             warnings.append("No allowed file types specified")
@@ -228,6 +283,24 @@ class ConfigurationManager:
         """Get database URL"""
         return self._config.database_url
     
+    def get_database_engine_options(self) -> Dict[str, Any]:
+        """Get SQLAlchemy engine and connection pool options"""
+        options = {
+            'pool_pre_ping': self._config.db_pool_pre_ping,
+            'pool_recycle': self._config.db_pool_recycle,
+        }
+        
+        # In-memory SQLite uses a single-connection pool that has no size limits
+        url = self._config.database_url
+        if not (url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url):
+            options.update({
+                'pool_size': self._config.db_pool_size,
+                'max_overflow': self._config.db_max_overflow,
+                'pool_timeout': self._config.db_pool_timeout,
+            })
+        
+        return options
+    
     def get_upload_directory(self) -> Path:
         """Get upload directory path"""
         return self._config.upload_directory
@@ -260,6 +333,10 @@ class ConfigurationManager:
         """Reload configuration from sources"""
         logger.info("Reloading configuration")
         self._load_configuration()
+    
+    def reload(self) -> None:
+        """Re-read environment variables, reusing the already parsed files"""
+        self._build_configuration()
 
 
 # Global configuration manager instance
@@ -3,6 +3,8 @@ Database migration manager for handling schema changes and data migrations
 """
 
 import logging
+import os
+from contextlib import closing
 from pathlib import Path
 from datetime import datetime
 from typing import List, Dict, Any
@@ -20,6 +22,26 @@ from models.database_models import db
 logger = logging.getLogger(__name__)
 
 
+def _copy_file(src: Path, dst: Path) -> None:
+    """Copy a file with its metadata, like shutil.copy2
+    
+    On Linux, os.copy_file_range lets the kernel copy without moving data
+    through user space, reflinking on filesystems that support it (Btrfs,
+    XFS). Elsewhere, or if the filesystem refuses, shutil.copyfile is used.
+    """
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+    except (AttributeError, OSError):
+        shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)
+
+
 class MigrationManager:
     """Manages database migrations and schema changes"""
     
@@ -45,7 +67,12 @@ class MigrationManager:
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 backup_path = self.backup_dir / f"attendance_backup_{timestamp}.db"
                 
-                shutil.copy2(db_path, backup_path)
+                # Fold any WAL contents into the main file so it is complete
+                # on its own; a no-op for databases not in WAL mode
+                with closing(sqlite3.connect(db_path)) as conn:
+                    conn.execute("PRAGMA wal_checkpoint(FULL)")
+                
+                _copy_file(db_path, backup_path)
                 logger.info(f"Database backed up to {backup_path}")
                 return backup_path
             else:
@@ -73,7 +100,12 @@ class MigrationManager:
                     current_backup = self.backup_database()
                     logger.info(f"Current database backed up to {current_backup}")
                 
-                shutil.copy2(backup_path, db_path)
+                # Copy the pages through SQLite rather than over the file, so
+                # a WAL or shared-memory file left by the live database is
+                # updated along with it instead of replayed onto the restore
+                with closing(sqlite3.connect(backup_path)) as source, \
+                        closing(sqlite3.connect(db_path)) as target:
+                    source.backup(target)
                 logger.info(f"Database restored from {backup_path}")
                 return True
             else:
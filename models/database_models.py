@@ -3,7 +3,7 @@ SQLAlchemy database models for the attendance system
 """
 
 from datetime import datetime, date
-from sqlalchemy import Column, Integer, String, DateTime, Date, Float, Text, ForeignKey, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, DateTime, Date, Float, Text, ForeignKey, Index, UniqueConstraint, DDL, event, Enum as SQLEnum
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref
 from flask_login import UserMixin
@@ -63,6 +63,42 @@ class Student(db.Model):
         return f"Student('{self.name}', '{self.registration_number}')"
 
 
+def _sqlite_has_trigram_fts(ddl, target, bind, **kw):
+    """Check that the SQLite library has FTS5 and its trigram tokenizer (3.34+)"""
+    if bind is None:
+        return False
+    version, has_fts5 = bind.exec_driver_sql(
+        "SELECT sqlite_version(), sqlite_compileoption_used('ENABLE_FTS5')"
+    ).one()
+    return bool(has_fts5) and tuple(map(int, version.split('.'))) >= (3, 34)
+
+
+# Substring name search index: FTS5 trigram table kept in sync by triggers
+# on SQLite, pg_trgm GIN index (used directly by ILIKE) on PostgreSQL.
+# SQLite builds without FTS5 get neither and search falls back to LIKE
+for statement in (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5("
+    "name, content='students', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS students_fts_ai AFTER INSERT ON students BEGIN "
+    "INSERT INTO students_fts(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS students_fts_ad AFTER DELETE ON students BEGIN "
+    "INSERT INTO students_fts(students_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS students_fts_au AFTER UPDATE OF name ON students BEGIN "
+    "INSERT INTO students_fts(students_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO students_fts(rowid, name) VALUES (new.id, new.name); END",
+):
+    event.listen(
+        Student.__table__, 'after_create',
+        DDL(statement).execute_if(dialect='sqlite', callable_=_sqlite_has_trigram_fts)
+    )
+
+for statement in (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_students_name_trgm ON students USING gin (name gin_trgm_ops)",
+):
+    event.listen(Student.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+
 class Class(db.Model):
     """Class model"""
     __tablename__ = 'classes'
@@ -108,6 +144,11 @@ class ClassEnrollment(db.Model):
 class AttendanceRecord(db.Model):
     """Attendance record model"""
     __tablename__ = 'attendance_records'
+    __table_args__ = (
+        # One record per student per session; the constraint's index also
+        # serves per-student history lookups instead of a scan
+        UniqueConstraint('student_id', 'session_id', name='uq_att_student_session'),
+    )
     
     id = Column(Integer, primary_key=True)
     student_id = Column(Integer, ForeignKey('students.id'), nullable=False)
@@ -130,6 +171,9 @@ class AttendanceRecord(db.Model):
 class AttendanceSession(db.Model):
     """Attendance session model"""
     __tablename__ = 'attendance_sessions'
+    __table_args__ = (
+        Index('ix_sess_class_date', 'class_id', 'date'),
+    )
     
     id = Column(Integer, primary_key=True)
     class_id = Column(Integer, ForeignKey('classes.id'), nullable=False)
@@ -31,6 +31,10 @@ def main():
         logger.info("Checking migration status...")
         status = simple_db_manager.get_migration_status()
         
+        if 'error' in status:
+            logger.error(f"Could not determine migration status: {status['error']}")
+            return False
+        
         logger.info(f"Database exists: {status.get('database_exists', False)}")
         logger.info(f"Migration needed: {status.get('migration_needed', 'unknown')}")
         
@@ -18,6 +18,12 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score
 import tensorflow as tf
 
+# Optional: safetensors keeps a local copy of the MobileNetV2 weights
+try:
+    import safetensors.numpy as safetensors_numpy
+except ImportError:
+    safetensors_numpy = None
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -25,6 +31,41 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def _weight_names(model):
+    """Unique names of a model's weights, in get_weights() order"""
+    return [getattr(weight, 'path', weight.name) for weight in model.weights]
+
+def _build_base_model(weights_path):
+    """Build MobileNetV2, taking the ImageNet weights from a local safetensors
+    copy when there is one and writing that copy otherwise"""
+    if safetensors_numpy is not None and os.path.exists(weights_path):
+        base_model = tf.keras.applications.MobileNetV2(
+            input_shape=(160, 160, 3),
+            include_top=False,
+            weights=None
+        )
+        try:
+            tensors = safetensors_numpy.load_file(weights_path)
+            base_model.set_weights([tensors[name] for name in _weight_names(base_model)])
+            return base_model
+        except Exception as e:
+            logger.warning(f"Could not load weights from {weights_path}: {e}")
+    
+    base_model = tf.keras.applications.MobileNetV2(
+        input_shape=(160, 160, 3),
+        include_top=False,
+        weights='imagenet'
+    )
+    
+    if safetensors_numpy is not None:
+        try:
+            safetensors_numpy.save_file(
+                dict(zip(_weight_names(base_model), base_model.get_weights())), weights_path
+            )
+        except Exception as e:
+            logger.warning(f"Could not save weights to {weights_path}: {e}")
+    return base_model
+
 class SimpleFaceTrainer:
     def __init__(self):
         self.project_root = Path(__file__).parent
@@ -33,6 +74,9 @@ class SimpleFaceTrainer:
         self.aligned_dir = self.project_root / "attendance/facenet/dataset/aligned"
         self.model_dir = self.project_root / "attendance/facenet/src/20180402-114759"
         self.classifier_path = self.model_dir / "my_classifier.pkl"
+        self.svm_path = self.model_dir / "my_classifier_svm.npz"
+        self.centroids_path = self.model_dir / "my_classifier_centroids.npz"
+        self.weights_path = self.model_dir / "mobilenet_v2.safetensors"
         
         # Face detection using OpenCV (simpler than MTCNN)
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
@@ -53,7 +97,8 @@ class SimpleFaceTrainer:
                 if dest_folder.exists():
                     shutil.rmtree(dest_folder)
                 
-                shutil.copytree(person_folder, dest_folder)
+                # Leave out the face box caches test_simple_model keeps next to the images
+                shutil.copytree(person_folder, dest_folder, ignore=shutil.ignore_patterns('*.bbox.npy'))
                 logger.info(f"Copied {person_folder.name} dataset")
         
         return True
@@ -117,20 +162,14 @@ class SimpleFaceTrainer:
         logger.info("Extracting features...")
         
         # Simple feature extraction using pre-trained MobileNet
-        base_model = tf.keras.applications.MobileNetV2(
-            input_shape=(160, 160, 3),
-            include_top=False,
-            weights='imagenet'
-        )
+        base_model = _build_base_model(str(self.weights_path))
         
-        # Add global average pooling
-        model = tf.keras.Sequential([
-            base_model,
-            tf.keras.layers.GlobalAveragePooling2D(),
-            tf.keras.layers.Dense(128, activation='relu'),
-            tf.keras.layers.Dropout(0.2),
-            tf.keras.layers.Dense(64, activation='relu')
-        ])
+        # Add global average pooling; the pooled 1280-d features are used
+        # directly, an untrained dense head would only add a random projection
+        model = tf.keras.Model(
+            base_model.input,
+            tf.keras.layers.GlobalAveragePooling2D()(base_model.output)
+        )
         
         features = []
         labels = []
@@ -195,13 +234,40 @@ class SimpleFaceTrainer:
         accuracy = accuracy_score(y_test, y_pred)
         logger.info(f"Training accuracy: {accuracy:.3f}")
         
+        # L2-normalized class centroids for cosine-similarity matching
+        centroids = np.stack([X_train[y_train == i].mean(axis=0) for i in range(len(label_encoder.classes_))])
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroid_pred = (X_test @ centroids.T).argmax(axis=1)
+        logger.info(f"Centroid accuracy: {accuracy_score(y_test, centroid_pred):.3f}")
+        
         # Save model and label encoder
         self.model_dir.mkdir(parents=True, exist_ok=True)
         
         with open(self.classifier_path, 'wb') as f:
             pickle.dump((svm_model, label_encoder.classes_), f)
         
+        np.savez(self.centroids_path, centroids=centroids.astype(np.float32), class_names=label_encoder.classes_)
+        
+        # The fitted SVM as plain arrays so it can be loaded without pickle.
+        # sklearn flips the signs of the public attributes for two classes;
+        # libsvm's orientation is stored
+        sign = -1.0 if len(svm_model.classes_) == 2 else 1.0
+        np.savez(
+            self.svm_path,
+            support_vectors=svm_model.support_vectors_,
+            dual_coef=sign * svm_model.dual_coef_,
+            intercept=sign * svm_model.intercept_,
+            n_support=svm_model.n_support_,
+            gamma=svm_model._gamma,
+            prob_a=svm_model.probA_,
+            prob_b=svm_model.probB_,
+            classes=svm_model.classes_,
+            class_names=label_encoder.classes_
+        )
+        
         logger.info(f"Model saved to {self.classifier_path}")
+        logger.info(f"Class centroids saved to {self.centroids_path}")
+        logger.info(f"SVM arrays saved to {self.svm_path}")
         return True
     
     def full_training_pipeline(self):
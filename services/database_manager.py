@@ -4,10 +4,11 @@ Database Manager for handling database operations with error recovery
 
 import logging
 from typing import List, Optional, Dict, Any
-from contextlib import contextmanager
+from contextlib import contextmanager, asynccontextmanager
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError, OperationalError
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy import create_engine, func, select, text
 import time
 
 # Import configuration and models
@@ -21,6 +22,24 @@ from models.domain_models import Student as DomainStudent, Class as DomainClass,
 
 logger = logging.getLogger(__name__)
 
+# Async drivers used for each sync database backend
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+}
+
+
+def use_read_committed(session) -> None:
+    """Run the session's transaction at READ COMMITTED isolation
+    
+    Must be called before the transaction's first statement. SQLite has no
+    READ COMMITTED level and its transactions are serializable, so it is
+    left at its default.
+    """
+    if session.get_bind().dialect.name != 'sqlite':
+        session.connection(execution_options={'isolation_level': 'READ COMMITTED'})
+
 
 class DatabaseError(Exception):
     """Custom database error"""
@@ -34,6 +53,38 @@ class DatabaseManager:
         self.db = db
         self._connection_retries = 3
         self._retry_delay = 1.0
+        self._async_session_factory = None
+    
+    def _get_async_session_factory(self):
+        """Create the async engine and session factory on first use"""
+        if self._async_session_factory is None:
+            # Imported lazily so sync-only deployments need no async driver
+            from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+            
+            url = make_url(config_manager.get_database_url())
+            backend = url.get_backend_name()
+            if backend not in ASYNC_DRIVERS:
+                raise DatabaseError(f"No async driver configured for database backend: {backend}")
+            
+            engine = create_async_engine(
+                url.set(drivername=ASYNC_DRIVERS[backend]),
+                **config_manager.get_database_engine_options()
+            )
+            self._async_session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        
+        return self._async_session_factory
+    
+    @asynccontextmanager
+    async def async_session(self):
+        """Get async database session that commits on success"""
+        async with self._get_async_session_factory()() as session:
+            try:
+                yield session
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"Async database session error: {e}")
+                raise DatabaseError(f"Database operation failed: {e}")
     
     @contextmanager
     def get_session(self):
@@ -50,6 +101,48 @@ class DatabaseManager:
             # Session is managed by Flask-SQLAlchemy, no need to close
             pass
     
+    @contextmanager
+    def session(self):
+        """Get database session for straight-line read paths
+        
+        Errors propagate unchanged; writes should keep going through the
+        retrying helpers. A transaction begun inside the block is committed
+        on exit, or rolled back on error, so the connection does not stay
+        idle in transaction and the next transaction can still pick its
+        isolation level. A caller's enclosing transaction is left alone.
+        The session itself stays open, so returned objects remain attached
+        and can still load lazy attributes.
+        """
+        session = self.db.session
+        owns_transaction = not session().in_transaction()
+        try:
+            yield session
+            if owns_transaction:
+                session.commit()
+        except Exception:
+            if owns_transaction:
+                session.rollback()
+            raise
+    
+    def execute_with_retry(self, operation):
+        """Run operation(session) in one transaction, retrying transient failures
+        
+        Commits when operation returns and rolls back when it raises.
+        Connection errors are retried with backoff; any other error, such as
+        IntegrityError, propagates unchanged.
+        """
+        def _run():
+            session = self.db.session
+            try:
+                result = operation(session)
+                session.commit()
+                return result
+            except Exception:
+                session.rollback()
+                raise
+        
+        return self._retry_operation(_run)
+    
     def _retry_operation(self, operation, *args, **kwargs):
         """Retry database operation with exponential backoff"""
         last_exception = None
@@ -78,6 +171,24 @@ class DatabaseManager:
             logger.error(f"Database health check failed: {e}")
             return False
     
+    def get_counts_bundle(self) -> Dict[str, int]:
+        """Count the rows of the main tables and the legacy table in one query"""
+        tables = {
+            'users': User,
+            'classes': Class,
+            'students': Student,
+            'enrollments': ClassEnrollment,
+            'legacy': Add,
+        }
+        
+        # One SELECT of scalar subqueries instead of a round-trip per table
+        stmt = select(*(
+            select(func.count()).select_from(model).scalar_subquery().label(name)
+            for name, model in tables.items()
+        ))
+        with self.session() as session:
+            return dict(session.execute(stmt).mappings().one())
+    
     def create_tables(self):
         """Create all database tables"""
         try:
@@ -434,5 +545,7 @@ class ClassRepository:
 
 # Global instances
 database_manager = DatabaseManager()
+# Name the repositories and migration utilities use for the shared manager
+db_manager = database_manager
 student_repository = StudentRepository(database_manager)
 class_repository = ClassRepository(database_manager)
\ No newline at end of file
@@ -9,6 +9,7 @@ import os
 import hashlib
 import logging
 import mimetypes
+import mmap
 from pathlib import Path
 from typing import List, Optional, Dict, Any, Tuple
 from dataclasses import dataclass
@@ -16,12 +17,19 @@ from datetime import datetime, timedelta
 import tempfile
 import shutil
 import re
+import secrets
+import threading
 import time
+import unicodedata
 
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 from PIL import Image
-# import magic # Optional, currently unused in visible code
+
+try:
+    import magic  # python-magic (libmagic bindings) is optional
+except ImportError:
+    magic = None
 
 # Import configuration
 import sys
@@ -30,6 +38,48 @@ from config.configuration_manager import config_manager
 
 logger = logging.getLogger(__name__)
 
+# Common image file signatures, checked before falling back to libmagic
+_IMAGE_SIGNATURES = {
+    b'\xff\xd8\xff': 'image/jpeg',
+    b'\x89\x50\x4e\x47\x0d\x0a\x1a\x0a': 'image/png',
+    b'\x47\x49\x46\x38': 'image/gif',
+    b'\x42\x4d': 'image/bmp',
+    b'\x52\x49\x46\x46': 'image/webp',  # Partial signature
+}
+
+# libmagic cookies are not thread-safe, so each thread gets its own
+_magic_local = threading.local()
+
+# Known malicious file signatures (simplified for demo)
+_EXECUTABLE_SIGNATURES = (
+    b'\x4d\x5a',  # PE executable header (EXE, DLL)
+    b'\x7f\x45\x4c\x46',  # ELF executable
+)
+
+# Script tags and script URLs, flagged in any scanned file
+_SCRIPT_SIGNATURES = (b'<script', b'javascript:', b'vbscript:')
+
+# Script markers that should never appear inside an image
+_SCRIPT_PATTERNS = _SCRIPT_SIGNATURES + (
+    b'onload=', b'onerror=', b'<?php', b'<%', b'#!/bin/', b'#!/usr/bin/'
+)
+
+
+def _compile_patterns(patterns, flags=0):
+    """Compile byte patterns into a single alternation regex"""
+    return re.compile(b'|'.join(re.escape(pattern) for pattern in patterns), flags)
+
+
+_EXECUTABLE_SIGNATURE_RE = _compile_patterns(_EXECUTABLE_SIGNATURES)
+_SCRIPT_PATTERN_RE = _compile_patterns(_SCRIPT_PATTERNS, re.IGNORECASE)
+_SCRIPT_SIGNATURE_RE = _compile_patterns(_SCRIPT_SIGNATURES, re.IGNORECASE)
+
+# Single-pass upload content scan, the matching group names the finding
+_CONTENT_SCAN_RE = re.compile(
+    b'(?P<executable>' + _EXECUTABLE_SIGNATURE_RE.pattern + b')'
+    b'|(?P<script>(?i:' + _SCRIPT_PATTERN_RE.pattern + b'))'
+)
+
 
 class SecurityError(Exception):
     """Exception raised for security violations"""
@@ -60,22 +110,17 @@ class FileInfo:
 class SecurityScanner:
     """Security scanner for uploaded files"""
     
-    def __init__(self):
-        # Known malicious file signatures (simplified for demo)
-        self.malicious_signatures = [
-            b'\x4d\x5a',  # PE executable header
-            b'\x7f\x45\x4c\x46',  # ELF executable header
-            b'<script',  # Script tags
-            b'javascript:',  # JavaScript URLs
-            b'vbscript:',  # VBScript URLs
-        ]
-        
-        # Suspicious patterns in filenames
-        self.suspicious_patterns = [
-            r'\.exe$', r'\.bat$', r'\.cmd$', r'\.com$', r'\.scr$',
-            r'\.vbs$', r'\.js$', r'\.jar$', r'\.php$', r'\.asp$',
-            r'\.jsp$', r'\.py$', r'\.pl$', r'\.sh$', r'\.ps1$'
-        ]
+    # Executable headers plus script tags and script URLs
+    malicious_signatures = _EXECUTABLE_SIGNATURES + _SCRIPT_SIGNATURES
+    
+    # Suspicious patterns in filenames
+    suspicious_patterns = (
+        r'\.exe$', r'\.bat$', r'\.cmd$', r'\.com$', r'\.scr$',
+        r'\.vbs$', r'\.js$', r'\.jar$', r'\.php$', r'\.asp$',
+        r'\.jsp$', r'\.py$', r'\.pl$', r'\.sh$', r'\.ps1$'
+    )
+    
+    _signature_re = _compile_patterns(malicious_signatures)
     
     def scan_file_content(self, file_path: Path) -> Tuple[bool, List[str]]:
         """Scan file content for malicious patterns"""
@@ -87,19 +132,13 @@ class SecurityScanner:
                 header = f.read(1024)
                 
                 # Check for malicious signatures
-                for signature in self.malicious_signatures:
-                    if signature in header:
-                        warnings.append(f"Suspicious file signature detected")
-                        break
+                if self._signature_re.search(header):
+                    warnings.append("Suspicious file signature detected")
                 
                 # For text-based files, check for suspicious content
                 if file_path.suffix.lower() in ['.txt', '.html', '.htm', '.xml']:
-                    try:
-                        content = header.decode('utf-8', errors='ignore').lower()
-                        if any(pattern in content for pattern in ['<script', 'javascript:', 'vbscript:']):
-                            warnings.append("Suspicious script content detected")
-                    except:
-                        pass
+                    if _SCRIPT_SIGNATURE_RE.search(header):
+                        warnings.append("Suspicious script content detected")
             
             return len(warnings) == 0, warnings
             
@@ -117,10 +156,6 @@ class FileHandler:
         self.max_file_size = config_manager.get_max_file_size()
         self.MAX_FILENAME_LENGTH = 255
         self.DANGEROUS_EXTENSIONS = {'php', 'phar', 'pl', 'py', 'asp', 'aspx', 'jsp', 'exe', 'sh', 'bat', 'cmd'}
-        self.MALICIOUS_SIGNATURES = [
-            b'\x4d\x5a',  # PE executable header (EXE, DLL)
-            b'\x7f\x45\x4c\x46',  # ELF executable
-        ]
 
     def validate_upload(self, file: FileStorage) -> ValidationResult:
         """
@@ -152,46 +187,39 @@ class FileHandler:
                 'content_type': file.content_type
             }
             
-            # Validate filename
-            filename_validation = self._validate_filename(original_filename)
-            if not filename_validation[0]:
-                errors.extend(filename_validation[1])
-            
-            # Validate file size
-            if file_size > self.max_file_size:
-                errors.append(f"File size ({file_size} bytes) exceeds maximum allowed size ({self.max_file_size} bytes)")
-            
-            if file_size == 0:
-                errors.append("File is empty")
+            # Run cheap, likely-failing checks first and stop at the first
+            # failure so rejected uploads never pay for reading file content
+            cheap_checks = (
+                (self._validate_size, file_size),
+                (self._validate_extension, original_filename),
+                (self._validate_filename, original_filename),
+                (self._validate_traversal, original_filename),
+            )
+            for check, value in cheap_checks:
+                passed, check_errors = check(value)
+                if not passed:
+                    return ValidationResult(False, check_errors, warnings, file_info)
             
-            # Validate file extension
-            extension_validation = self._validate_extension(original_filename)
-            if not extension_validation[0]:
-                errors.extend(extension_validation[1])
+            # Only now read the file header, shared by MIME and content checks
+            header = self._read_header(file, 1024)
+            extension = Path(original_filename).suffix.lower().lstrip('.')
             
             # Validate MIME type
-            mime_validation = self._validate_mime_type(file)
+            mime_validation = self._validate_mime_type(header, extension)
             if not mime_validation[0]:
-                errors.extend(mime_validation[1])
-            else:
-                file_info['detected_mime_type'] = mime_validation[1]
+                return ValidationResult(False, mime_validation[1], warnings, file_info)
+            file_info['detected_mime_type'] = mime_validation[1]
             
             # Scan file content for malicious signatures
-            content_validation = self._scan_file_content(file)
+            content_validation = self._scan_file_content(header)
             if not content_validation[0]:
-                errors.extend(content_validation[1])
-            
-            # Check for directory traversal attempts
-            if self._has_directory_traversal(original_filename):
-                errors.append("Filename contains directory traversal patterns")
+                return ValidationResult(False, content_validation[1], warnings, file_info)
             
             # Additional security checks
             security_warnings = self._perform_security_checks(file, original_filename)
             warnings.extend(security_warnings)
             
-            is_valid = len(errors) == 0
-            
-            return ValidationResult(is_valid, errors, warnings, file_info)
+            return ValidationResult(True, errors, warnings, file_info)
             
         except Exception as e:
             logger.error(f"File validation error: {e}")
@@ -215,6 +243,27 @@ class FileHandler:
         except Exception:
             return 0
     
+    def _read_header(self, file: FileStorage, size: int) -> bytes:
+        """Read the first bytes of the file without moving the stream position"""
+        current_pos = file.tell()
+        try:
+            file.seek(0)
+            return file.read(size)
+        finally:
+            file.seek(current_pos)
+    
+    def _validate_size(self, file_size: int) -> Tuple[bool, List[str]]:
+        """Validate file size"""
+        max_size = self.max_file_size
+        
+        if file_size == 0:
+            return False, ["File is empty"]
+        
+        if file_size > max_size:
+            return False, [f"File size ({file_size} bytes) exceeds maximum allowed size ({max_size} bytes)"]
+        
+        return True, []
+    
     def _validate_filename(self, filename: str) -> Tuple[bool, List[str]]:
         """Validate filename for security issues"""
         errors = []
@@ -224,8 +273,9 @@ class FileHandler:
             return False, errors
         
         # Check filename length
-        if len(filename) > self.MAX_FILENAME_LENGTH:
-            errors.append(f"Filename too long (max {self.MAX_FILENAME_LENGTH} characters)")
+        max_length = self.MAX_FILENAME_LENGTH
+        if len(filename) > max_length:
+            errors.append(f"Filename too long (max {max_length} characters)")
         
         # Check for null bytes
         if '\x00' in filename:
@@ -258,6 +308,8 @@ class FileHandler:
     def _validate_extension(self, filename: str) -> Tuple[bool, List[str]]:
         """Validate file extension"""
         errors = []
+        allowed = self.allowed_extensions
+        dangerous = self.DANGEROUS_EXTENSIONS
         
         # Get file extension
         extension = Path(filename).suffix.lower().lstrip('.')
@@ -267,32 +319,22 @@ class FileHandler:
             return False, errors
         
         # Check against dangerous extensions
-        if extension in self.DANGEROUS_EXTENSIONS:
+        if extension in dangerous:
             errors.append(f"File extension '{extension}' is not allowed for security reasons")
         
         # Check against allowed extensions
-        if extension not in self.allowed_extensions:
-            errors.append(f"File extension '{extension}' is not allowed. Allowed: {', '.join(self.allowed_extensions)}")
+        if extension not in allowed:
+            errors.append(f"File extension '{extension}' is not allowed. Allowed: {', '.join(allowed)}")
         
         return len(errors) == 0, errors
     
-    def _validate_mime_type(self, file: FileStorage) -> Tuple[bool, List[str]]:
-        """Validate MIME type by examining file content"""
+    def _validate_mime_type(self, header: bytes, extension: str) -> Tuple[bool, Any]:
+        """Validate MIME type by examining the file header"""
         try:
-            # Save current position
-            current_pos = file.tell()
-            
-            # Read first few bytes for MIME detection
-            file.seek(0)
-            header = file.read(512)
-            file.seek(current_pos)
-            
             # Detect MIME type from content
             detected_mime = self._detect_mime_type(header)
             
             # Get expected MIME types for allowed extensions
-            filename = file.filename or ''
-            extension = Path(filename).suffix.lower().lstrip('.')
             expected_mimes = self._get_expected_mime_types(extension)
             
             if detected_mime and expected_mimes:
@@ -307,20 +349,25 @@ class FileHandler:
     
     def _detect_mime_type(self, header: bytes) -> Optional[str]:
         """Detect MIME type from file header"""
-        # Common image file signatures
-        signatures = {
-            b'\xff\xd8\xff': 'image/jpeg',
-            b'\x89\x50\x4e\x47\x0d\x0a\x1a\x0a': 'image/png',
-            b'\x47\x49\x46\x38': 'image/gif',
-            b'\x42\x4d': 'image/bmp',
-            b'\x52\x49\x46\x46': 'image/webp',  # Partial signature
-        }
-        
-        for signature, mime_type in signatures.items():
+        # Fast path for common image formats, skips the libmagic call entirely
+        for signature, mime_type in _IMAGE_SIGNATURES.items():
             if header.startswith(signature):
                 return mime_type
         
-        return None
+        if magic is None:
+            return None
+        
+        detector = getattr(_magic_local, 'detector', None)
+        if detector is None:
+            detector = _magic_local.detector = magic.Magic(mime=True)
+        
+        detected_mime = detector.from_buffer(header)
+        
+        # libmagic reports unrecognised binary data as a generic octet stream
+        if not detected_mime or detected_mime == 'application/octet-stream':
+            return None
+        
+        return detected_mime
     
     def _get_expected_mime_types(self, extension: str) -> List[str]:
         """Get expected MIME types for file extension"""
@@ -335,27 +382,18 @@ class FileHandler:
         
         return mime_map.get(extension, [])
     
-    def _scan_file_content(self, file: FileStorage) -> Tuple[bool, List[str]]:
-        """Scan file content for malicious signatures"""
+    def _scan_file_content(self, content: bytes) -> Tuple[bool, List[str]]:
+        """Scan file header for malicious signatures"""
         try:
-            # Save current position
-            current_pos = file.tell()
-            
-            # Read first 1KB for signature scanning
-            file.seek(0)
-            content = file.read(1024)
-            file.seek(current_pos)
-            
             errors = []
             
-            # Check for malicious signatures
-            for signature in self.MALICIOUS_SIGNATURES:
-                if signature in content:
-                    errors.append("File contains potentially malicious content")
-                    break
+            # Check for malicious signatures and embedded scripts in one pass
+            findings = {match.lastgroup for match in _CONTENT_SCAN_RE.finditer(content)}
+            
+            if 'executable' in findings:
+                errors.append("File contains potentially malicious content")
             
-            # Check for embedded scripts in images
-            if self._has_embedded_scripts(content):
+            if 'script' in findings:
                 errors.append("File may contain embedded scripts")
             
             return len(errors) == 0, errors
@@ -364,15 +402,11 @@ class FileHandler:
             logger.warning(f"Content scanning error: {e}")
             return True, []  # Don't fail validation on scanning errors
     
-    def _has_embedded_scripts(self, content: bytes) -> bool:
-        """Check for embedded scripts in file content"""
-        script_patterns = [
-            b'<script', b'javascript:', b'vbscript:', b'onload=', b'onerror=',
-            b'<?php', b'<%', b'#!/bin/', b'#!/usr/bin/'
-        ]
-        
-        content_lower = content.lower()
-        return any(pattern in content_lower for pattern in script_patterns)
+    def _validate_traversal(self, filename: str) -> Tuple[bool, List[str]]:
+        """Validate filename against directory traversal attempts"""
+        if self._has_directory_traversal(filename):
+            return False, ["Filename contains directory traversal patterns"]
+        return True, []
     
     def _has_directory_traversal(self, filename: str) -> bool:
         """Check for directory traversal attempts"""
@@ -393,8 +427,8 @@ class FileHandler:
             warnings.append("Filename is unusually long")
         
         # Check for Unicode normalization attacks
-        if filename != filename.encode('utf-8').decode('utf-8'):
-            warnings.append("Filename contains non-standard Unicode characters")
+        if not unicodedata.is_normalized('NFC', filename):
+            warnings.append("Filename not in NFC form")
         
         return warnings
     
@@ -417,6 +451,7 @@ class FileHandler:
         if not validation_result.is_valid:
             raise SecurityError(f"File validation failed: {'; '.join(validation_result.errors)}")
         
+        file_path = None
         try:
             # Generate secure filename
             original_name = file.filename
@@ -430,7 +465,7 @@ class FileHandler:
             file_path = self._get_unique_filepath(target_dir / secure_name)
             
             # Save file
-            file.save(str(file_path))
+            self._write_upload(file, file_path)
             
             # Get file information
             file_size = file_path.stat().st_size
@@ -453,8 +488,38 @@ class FileHandler:
             
         except Exception as e:
             logger.error(f"Error saving file: {e}")
+            # Don't leave the reserved (possibly partially written) file behind
+            if file_path is not None:
+                file_path.unlink(missing_ok=True)
             raise SecurityError(f"Failed to save file: {str(e)}")
     
+    def _write_upload(self, file: FileStorage, file_path: Path) -> None:
+        """Write upload to disk, copying in-kernel when the stream has a real fd"""
+        try:
+            stream = file.stream
+            stream.flush()
+            src_fd = stream.fileno()
+            offset = stream.tell()
+            remaining = os.fstat(src_fd).st_size - offset
+            copy_file_range = getattr(os, 'copy_file_range', None)
+            
+            with open(file_path, 'wb') as dst:
+                dst_fd = dst.fileno()
+                # Copies may be partial, loop until the source is exhausted
+                while remaining > 0:
+                    if copy_file_range is not None:
+                        copied = copy_file_range(src_fd, dst_fd, remaining, offset)
+                    else:
+                        copied = os.sendfile(dst_fd, src_fd, offset, remaining)
+                    if copied == 0:
+                        break
+                    offset += copied
+                    remaining -= copied
+        except (AttributeError, ValueError, OSError):
+            # In-memory streams have no fd and not every platform/filesystem
+            # supports in-kernel copies - fall back to werkzeug's buffered copy
+            file.save(str(file_path))
+    
     def _generate_secure_filename(self, filename: str) -> str:
         """Generate a secure filename"""
         # Use werkzeug's secure_filename as base
@@ -480,25 +545,27 @@ class FileHandler:
         return secure_name
     
     def _get_unique_filepath(self, base_path: Path) -> Path:
-        """Get unique filepath to prevent conflicts"""
-        if not base_path.exists():
-            return base_path
-        
-        # Add counter to make unique
-        counter = 1
+        """Reserve a unique filepath to prevent conflicts"""
+        candidate = base_path
         while True:
-            name_parts = base_path.name.rsplit('.', 1)
-            if len(name_parts) == 2:
-                name, ext = name_parts
-                new_name = f"{name}_{counter}.{ext}"
-            else:
-                new_name = f"{base_path.name}_{counter}"
-            
-            new_path = base_path.parent / new_name
-            if not new_path.exists():
-                return new_path
-            
-            counter += 1
+            try:
+                # O_EXCL creates the file atomically, so no separate exists() check
+                fd = os.open(str(candidate), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                # Add a random suffix and retry, collisions are vanishingly rare
+                name_parts = base_path.name.rsplit('.', 1)
+                token = secrets.token_urlsafe(8)
+                if len(name_parts) == 2:
+                    name, ext = name_parts
+                    new_name = f"{name}_{token}.{ext}"
+                else:
+                    new_name = f"{base_path.name}_{token}"
+                
+                candidate = base_path.parent / new_name
+                continue
+            
+            os.close(fd)
+            return candidate
     
     def _calculate_file_hash(self, file_path: Path) -> str:
         """Calculate SHA-256 hash of file"""
@@ -523,28 +590,44 @@ class FileHandler:
             True if file is clean, False if suspicious
         """
         try:
-            # Basic malware scanning - check file signatures
-            with open(file_path, 'rb') as f:
-                header = f.read(1024)
-            
-            # Check for malicious signatures
-            for signature in self.MALICIOUS_SIGNATURES:
-                if signature in header:
-                    logger.warning(f"Malicious signature detected in {file_path}")
-                    return False
-            
-            # Check file size (extremely large files might be suspicious)
-            file_size = file_path.stat().st_size
-            if file_size > self.max_file_size * 2:  # Double the normal limit
-                logger.warning(f"Suspiciously large file: {file_path} ({file_size} bytes)")
-                return False
-            
-            return True
+            return self.check_for_malware(file_path)
             
         except Exception as e:
             logger.error(f"Malware scanning error: {e}")
             return False  # Err on the side of caution
     
+    def check_for_malware(self, file_path: Path) -> bool:
+        """
+        Scan file for malware, raising instead of failing closed
+        
+        Args:
+            file_path: Path to file to scan
+            
+        Returns:
+            True if file is clean, False if suspicious
+            
+        Raises:
+            OSError: If the file cannot be read
+        """
+        # Basic malware scanning - check file signatures
+        with open(file_path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            
+            # Map the first 1KB and search it in place instead of copying
+            # it into a new bytes object (empty files cannot be mapped)
+            if file_size:
+                with mmap.mmap(f.fileno(), min(1024, file_size), access=mmap.ACCESS_READ) as header:
+                    if _EXECUTABLE_SIGNATURE_RE.search(header):
+                        logger.warning(f"Malicious signature detected in {file_path}")
+                        return False
+        
+        # Check file size (extremely large files might be suspicious)
+        if file_size > self.max_file_size * 2:  # Double the normal limit
+            logger.warning(f"Suspiciously large file: {file_path} ({file_size} bytes)")
+            return False
+        
+        return True
+    
     def cleanup_temp_files(self, older_than: timedelta = timedelta(hours=24)) -> int:
         """
         Clean up temporary files older than specified time
@@ -6,28 +6,96 @@ and business logic separation.
 """
 
 import logging
-from typing import Optional, List, Dict, Any, Type, TypeVar
-from datetime import date, datetime
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy import and_, or_, desc, asc
-import sys
-from pathlib import Path
-
-# Add project root to Python path for imports
-project_root = Path(__file__).parent.parent
-sys.path.insert(0, str(project_root))
-
-from models.domain_models import (
+import functools
+from typing import Optional, List, Dict, Any, Iterator, Tuple, Type, TypeVar
+from datetime import date
+from flask import g, has_request_context
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy import and_, or_, desc, asc, bindparam, delete, func, insert, literal, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Row
+
+from models.database_models import (
     User, Student, Class, ClassEnrollment, AttendanceSession, 
-    AttendanceRecord, AttendanceStatus, Add
+    AttendanceRecord, Add
 )
-from services.database_manager import db_manager, DatabaseError
+from services.database_manager import db_manager, DatabaseError, use_read_committed
 
 logger = logging.getLogger(__name__)
 
 T = TypeVar('T')
 
+# Maximum number of values bound into a single IN (...) lookup
+_IN_BATCH_SIZE = 500
+
+# Hot lookups are built once so every call reuses the same compiled statement
+_USER_BY_USERNAME = select(User).where(User.username == bindparam('username'))
+_USER_BY_EMAIL = select(User).where(User.email == bindparam('email'))
+_STUDENT_BY_REGISTRATION_NUMBER = select(Student).where(
+    Student.registration_number == bindparam('registration_number')
+)
+
+
+def _get_request_cache() -> Optional[Dict[tuple, Any]]:
+    """Get the lookup cache for the current request
+    
+    Returns None outside a Flask request, so scripts and migrations always
+    read through to the database.
+    """
+    if not has_request_context():
+        return None
+    # Stored on g so it is discarded at the end of every request
+    if 'repository_cache' not in g:
+        g.repository_cache = {}
+    return g.repository_cache
+
+
+def invalidate_cached_lookups(*models) -> None:
+    """Drop the request's cached lookups for the given models after a write"""
+    cache = _get_request_cache()
+    if not cache:
+        return
+    model_names = {model.__name__ for model in models}
+    for key in [key for key in cache if key[0] in model_names]:
+        del cache[key]
+
+
+def _insert_ignoring_conflicts(session: Session, model):
+    """Build an INSERT that skips rows violating a unique constraint
+    
+    Dialects without ON CONFLICT support get a plain INSERT, so conflicts
+    there still raise IntegrityError.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing()
+    return insert(model)
+
+
+def cached(kind: str):
+    """Memoize a single-key repository lookup in the request cache"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, key):
+            cache = _get_request_cache()
+            if cache is None:
+                return method(self, key)
+            
+            cache_key = (self.model_class.__name__, kind, key)
+            if cache_key in cache:
+                return cache[cache_key]
+            
+            result = method(self, key)
+            # Misses are not cached so rows added later are always found
+            if result is not None:
+                cache[cache_key] = result
+            return result
+        return wrapper
+    return decorator
+
 
 class BaseRepository:
     """Base repository with common CRUD operations"""
@@ -35,8 +103,14 @@ class BaseRepository:
     def __init__(self, model_class: Type[T]):
         self.model_class = model_class
     
+    def _invalidate_cache(self) -> None:
+        """Drop cached lookups for this repository's model after a write"""
+        invalidate_cached_lookups(self.model_class)
+    
     def create(self, **kwargs) -> T:
         """Create a new record"""
+        self._invalidate_cache()
+        
         def _create(session: Session):
             instance = self.model_class(**kwargs)
             session.add(instance)
@@ -45,25 +119,31 @@ class BaseRepository:
         
         return db_manager.execute_with_retry(_create)
     
+    @cached('by_id')
     def get_by_id(self, record_id: int) -> Optional[T]:
         """Get record by ID"""
-        def _get(session: Session):
-            return session.query(self.model_class).filter_by(id=record_id).first()
-        
-        return db_manager.execute_with_retry(_get)
+        with db_manager.session() as session:
+            return session.get(self.model_class, record_id)
     
     def get_all(self, limit: Optional[int] = None, offset: int = 0) -> List[T]:
         """Get all records with optional pagination"""
-        def _get_all(session: Session):
+        with db_manager.session() as session:
             query = session.query(self.model_class)
             if limit:
                 query = query.limit(limit).offset(offset)
             return query.all()
-        
-        return db_manager.execute_with_retry(_get_all)
+    
+    def get_where(self, **filters) -> List[T]:
+        """Get all records whose columns equal the given values"""
+        with db_manager.session() as session:
+            return session.execute(
+                select(self.model_class).filter_by(**filters)
+            ).scalars().all()
     
     def update(self, record_id: int, **kwargs) -> Optional[T]:
         """Update record by ID"""
+        self._invalidate_cache()
+        
         def _update(session: Session):
             instance = session.query(self.model_class).filter_by(id=record_id).first()
             if instance:
@@ -77,6 +157,8 @@ class BaseRepository:
     
     def delete(self, record_id: int) -> bool:
         """Delete record by ID"""
+        self._invalidate_cache()
+        
         def _delete(session: Session):
             instance = session.query(self.model_class).filter_by(id=record_id).first()
             if instance:
@@ -88,10 +170,74 @@ class BaseRepository:
     
     def count(self) -> int:
         """Count total records"""
-        def _count(session: Session):
+        with db_manager.session() as session:
             return session.query(self.model_class).count()
+
+
+class AsyncBaseRepository:
+    """Async counterpart of BaseRepository for async request handlers
+    
+    Uses the same model classes through an AsyncSession so handlers can await
+    database I/O instead of blocking a worker. Scripts keep using the sync
+    repositories.
+    """
+    
+    def __init__(self, model_class: Type[T]):
+        self.model_class = model_class
+    
+    async def create(self, **kwargs) -> T:
+        """Create a new record"""
+        invalidate_cached_lookups(self.model_class)
+        
+        async with db_manager.async_session() as session:
+            instance = self.model_class(**kwargs)
+            session.add(instance)
+            await session.flush()
+            return instance
+    
+    async def get_by_id(self, record_id: int) -> Optional[T]:
+        """Get record by ID"""
+        async with db_manager.async_session() as session:
+            return await session.get(self.model_class, record_id)
+    
+    async def get_all(self, limit: Optional[int] = None, offset: int = 0) -> List[T]:
+        """Get all records with optional pagination"""
+        async with db_manager.async_session() as session:
+            stmt = select(self.model_class).offset(offset)
+            if limit:
+                stmt = stmt.limit(limit)
+            return list((await session.execute(stmt)).scalars())
+    
+    async def update(self, record_id: int, **kwargs) -> Optional[T]:
+        """Update record by ID"""
+        invalidate_cached_lookups(self.model_class)
+        
+        async with db_manager.async_session() as session:
+            instance = await session.get(self.model_class, record_id)
+            if instance:
+                for key, value in kwargs.items():
+                    if hasattr(instance, key):
+                        setattr(instance, key, value)
+                await session.flush()
+            return instance
+    
+    async def delete(self, record_id: int) -> bool:
+        """Delete record by ID"""
+        invalidate_cached_lookups(self.model_class)
         
-        return db_manager.execute_with_retry(_count)
+        async with db_manager.async_session() as session:
+            instance = await session.get(self.model_class, record_id)
+            if instance:
+                await session.delete(instance)
+                return True
+            return False
+    
+    async def count(self) -> int:
+        """Count total records"""
+        async with db_manager.async_session() as session:
+            return (await session.execute(
+                select(func.count()).select_from(self.model_class)
+            )).scalar_one()
 
 
 class UserRepository(BaseRepository):
@@ -100,28 +246,47 @@ class UserRepository(BaseRepository):
     def __init__(self):
         super().__init__(User)
     
+    @cached('by_username')
     def get_by_username(self, username: str) -> Optional[User]:
         """Get user by username"""
-        def _get(session: Session):
-            return session.query(User).filter_by(username=username).first()
-        
-        return db_manager.execute_with_retry(_get)
+        with db_manager.session() as session:
+            return session.execute(
+                _USER_BY_USERNAME, {'username': username}
+            ).scalar_one_or_none()
     
+    @cached('by_email')
     def get_by_email(self, email: str) -> Optional[User]:
         """Get user by email"""
-        def _get(session: Session):
-            return session.query(User).filter_by(email=email.lower()).first()
-        
-        return db_manager.execute_with_retry(_get)
+        with db_manager.session() as session:
+            return session.execute(
+                _USER_BY_EMAIL, {'email': email.lower()}
+            ).scalar_one_or_none()
     
     def create_user(self, username: str, email: str, password: str) -> User:
         """Create a new user with validation"""
+        self._invalidate_cache()
+        email = email.lower()
+        
+        def _create_user(session: Session):
+            user = session.execute(
+                _insert_ignoring_conflicts(session, User).values(
+                    username=username,
+                    email=email,
+                    password=password
+                ).returning(User)
+            ).scalar_one_or_none()
+            if user:
+                return user, None
+            
+            # Nothing inserted: find out which unique column conflicted
+            if session.execute(select(User.id).where(User.username == username)).first():
+                return None, "Username already exists"
+            if session.execute(select(User.id).where(User.email == email)).first():
+                return None, "Email already exists"
+            return None, "User creation failed"
+        
         try:
-            return self.create(
-                username=username,
-                email=email.lower(),
-                password=password
-            )
+            user, error = db_manager.execute_with_retry(_create_user)
         except IntegrityError as e:
             if "username" in str(e):
                 raise DatabaseError("Username already exists")
@@ -129,13 +294,10 @@ class UserRepository(BaseRepository):
                 raise DatabaseError("Email already exists")
             else:
                 raise DatabaseError("User creation failed")
-    
-    def get_active_users(self) -> List[User]:
-        """Get all active users"""
-        def _get_active(session: Session):
-            return session.query(User).filter_by(is_active=True).all()
         
-        return db_manager.execute_with_retry(_get_active)
+        if error:
+            raise DatabaseError(error)
+        return user
 
 
 class StudentRepository(BaseRepository):
@@ -144,41 +306,68 @@ class StudentRepository(BaseRepository):
     def __init__(self):
         super().__init__(Student)
     
+    @cached('by_registration_number')
     def get_by_registration_number(self, reg_num: str) -> Optional[Student]:
         """Get student by registration number"""
-        def _get(session: Session):
-            return session.query(Student).filter_by(
-                registration_number=reg_num.upper()
-            ).first()
-        
-        return db_manager.execute_with_retry(_get)
+        with db_manager.session() as session:
+            return session.execute(
+                _STUDENT_BY_REGISTRATION_NUMBER, {'registration_number': reg_num.upper()}
+            ).scalar_one_or_none()
     
     def search_by_name(self, name_pattern: str) -> List[Student]:
         """Search students by name pattern"""
-        def _search(session: Session):
+        pattern = f"%{name_pattern}%"
+        
+        with db_manager.session() as session:
+            if session.get_bind().dialect.name == 'sqlite':
+                # LIKE on the trigram FTS table is an index probe, not a scan
+                try:
+                    return session.execute(
+                        select(Student).from_statement(text(
+                            "SELECT students.* FROM students "
+                            "JOIN students_fts ON students_fts.rowid = students.id "
+                            "WHERE students_fts.name LIKE :pattern"
+                        )),
+                        {'pattern': pattern}
+                    ).scalars().all()
+                except OperationalError:
+                    # Database created before the search index existed
+                    pass
+            
             return session.query(Student).filter(
-                Student.name.ilike(f"%{name_pattern}%")
+                Student.name.ilike(pattern)
             ).all()
-        
-        return db_manager.execute_with_retry(_search)
-    
-    def get_active_students(self) -> List[Student]:
-        """Get all active students"""
-        def _get_active(session: Session):
-            return session.query(Student).filter_by(is_active=True).all()
-        
-        return db_manager.execute_with_retry(_get_active)
     
     def create_student(self, name: str, registration_number: str, 
                       email: Optional[str] = None, phone: Optional[str] = None) -> Student:
         """Create a new student with validation"""
+        self._invalidate_cache()
+        registration_number = registration_number.upper()
+        email = email.lower() if email else None
+        
+        def _create_student(session: Session):
+            student = session.execute(
+                _insert_ignoring_conflicts(session, Student).values(
+                    name=name,
+                    registration_number=registration_number,
+                    email=email,
+                    phone=phone
+                ).returning(Student)
+            ).scalar_one_or_none()
+            if student:
+                return student, None
+            
+            # Nothing inserted: find out which unique column conflicted
+            if session.execute(
+                select(Student.id).where(Student.registration_number == registration_number)
+            ).first():
+                return None, "Registration number already exists"
+            if email and session.execute(select(Student.id).where(Student.email == email)).first():
+                return None, "Email already exists"
+            return None, "Student creation failed"
+        
         try:
-            return self.create(
-                name=name,
-                registration_number=registration_number.upper(),
-                email=email.lower() if email else None,
-                phone=phone
-            )
+            student, error = db_manager.execute_with_retry(_create_student)
         except IntegrityError as e:
             if "registration_number" in str(e):
                 raise DatabaseError("Registration number already exists")
@@ -186,6 +375,10 @@ class StudentRepository(BaseRepository):
                 raise DatabaseError("Email already exists")
             else:
                 raise DatabaseError("Student creation failed")
+        
+        if error:
+            raise DatabaseError(error)
+        return student
 
 
 class ClassRepository(BaseRepository):
@@ -196,36 +389,22 @@ class ClassRepository(BaseRepository):
     
     def get_by_name(self, name: str) -> Optional[Class]:
         """Get class by name"""
-        def _get(session: Session):
+        with db_manager.session() as session:
             return session.query(Class).filter_by(name=name).first()
-        
-        return db_manager.execute_with_retry(_get)
-    
-    def get_active_classes(self) -> List[Class]:
-        """Get all active classes"""
-        def _get_active(session: Session):
-            return session.query(Class).filter_by(is_active=True).all()
-        
-        return db_manager.execute_with_retry(_get_active)
     
     def get_classes_by_coordinator(self, coordinator_email: str) -> List[Class]:
         """Get classes by coordinator email"""
-        def _get_by_coordinator(session: Session):
+        with db_manager.session() as session:
             return session.query(Class).filter_by(
                 coordinator_email=coordinator_email.lower()
             ).all()
-        
-        return db_manager.execute_with_retry(_get_by_coordinator)
     
-    def create_class(self, name: str, coordinator: str, coordinator_email: str,
-                    description: Optional[str] = None, coordinator_user_id: Optional[int] = None) -> Class:
+    def create_class(self, name: str, coordinator: str, coordinator_email: str) -> Class:
         """Create a new class"""
         return self.create(
             name=name,
             coordinator=coordinator,
-            coordinator_email=coordinator_email.lower(),
-            description=description,
-            coordinator_user_id=coordinator_user_id
+            coordinator_email=coordinator_email.lower()
         )
 
 
@@ -245,42 +424,90 @@ class ClassEnrollmentRepository(BaseRepository):
         except IntegrityError:
             raise DatabaseError("Student is already enrolled in this class")
     
-    def get_class_students(self, class_id: int, active_only: bool = True) -> List[Student]:
+    def enroll_by_prefix(self, class_id: int, reg_prefix: str,
+                         registration_numbers: Optional[List[str]] = None,
+                         session: Optional[Session] = None) -> int:
+        """Enroll every student whose registration number starts with reg_prefix
+        
+        Runs as a single INSERT ... SELECT that skips students already
+        enrolled in the class, so no rows travel to Python. Pass
+        registration_numbers to enroll only those students, and session to
+        run inside a caller's transaction. Returns the number of enrollments
+        created.
+        """
+        self._invalidate_cache()
+        
+        conditions = [Student.registration_number.like(f"{reg_prefix}%")]
+        if registration_numbers is not None:
+            conditions.append(Student.registration_number.in_(registration_numbers))
+        conditions.append(~select(ClassEnrollment.id).where(
+            ClassEnrollment.student_id == Student.id,
+            ClassEnrollment.class_id == class_id
+        ).exists())
+        # include_defaults renders the model's column defaults (enrolled_at)
+        # into the SELECT, which a raw text() INSERT would skip
+        stmt = insert(ClassEnrollment).from_select(
+            [ClassEnrollment.student_id, ClassEnrollment.class_id],
+            select(Student.id, literal(class_id)).where(*conditions)
+        )
+        
+        def _enroll(session: Session) -> int:
+            return session.execute(stmt).rowcount
+        
+        if session is not None:
+            return _enroll(session)
+        return db_manager.execute_with_retry(_enroll)
+    
+    def get_class_students(self, class_id: int) -> List[Student]:
         """Get all students enrolled in a class"""
-        def _get_students(session: Session):
-            query = session.query(Student).join(ClassEnrollment).filter(
+        with db_manager.session() as session:
+            # Load related collections with one IN query each instead of a lazy
+            # load per student
+            query = session.query(Student).join(ClassEnrollment).options(
+                selectinload(Student.class_enrollments),
+                selectinload(Student.attendance_records)
+            ).filter(
                 ClassEnrollment.class_id == class_id
             )
-            if active_only:
-                query = query.filter(ClassEnrollment.is_active == True)
             return query.all()
+    
+    def list_class_students_lite(self, class_id: int) -> List[Row]:
+        """Get (id, name, registration_number) rows for a class's students
         
-        return db_manager.execute_with_retry(_get_students)
+        For listing and export paths that only render these columns; rows are
+        plain tuples, skipping ORM object hydration and identity-map work.
+        """
+        with db_manager.session() as session:
+            stmt = select(
+                Student.id, Student.name, Student.registration_number
+            ).join(ClassEnrollment).where(
+                ClassEnrollment.class_id == class_id
+            )
+            return session.execute(stmt).all()
     
-    def get_student_classes(self, student_id: int, active_only: bool = True) -> List[Class]:
+    def get_student_classes(self, student_id: int) -> List[Class]:
         """Get all classes a student is enrolled in"""
-        def _get_classes(session: Session):
-            query = session.query(Class).join(ClassEnrollment).filter(
+        with db_manager.session() as session:
+            query = session.query(Class).join(ClassEnrollment).options(
+                selectinload(Class.enrollments)
+            ).filter(
                 ClassEnrollment.student_id == student_id
             )
-            if active_only:
-                query = query.filter(ClassEnrollment.is_active == True)
             return query.all()
-        
-        return db_manager.execute_with_retry(_get_classes)
     
     def unenroll_student(self, student_id: int, class_id: int) -> bool:
-        """Unenroll a student from a class (soft delete)"""
+        """Unenroll a student from a class"""
+        self._invalidate_cache()
+        
         def _unenroll(session: Session):
-            enrollment = session.query(ClassEnrollment).filter_by(
-                student_id=student_id,
-                class_id=class_id,
-                is_active=True
-            ).first()
-            if enrollment:
-                enrollment.is_active = False
-                return True
-            return False
+            # Enrollments have no active flag, so unenrolling removes the row
+            result = session.execute(
+                delete(ClassEnrollment).where(
+                    ClassEnrollment.student_id == student_id,
+                    ClassEnrollment.class_id == class_id
+                )
+            )
+            return result.rowcount > 0
         
         return db_manager.execute_with_retry(_unenroll)
 
@@ -292,41 +519,35 @@ class AttendanceSessionRepository(BaseRepository):
         super().__init__(AttendanceSession)
     
     def create_session(self, class_id: int, session_date: date, 
-                      image_path: Optional[str] = None,
-                      processed_by_user_id: Optional[int] = None) -> AttendanceSession:
+                      image_path: Optional[str] = None) -> AttendanceSession:
         """Create a new attendance session"""
         return self.create(
             class_id=class_id,
-            session_date=session_date,
-            image_path=image_path,
-            processed_by_user_id=processed_by_user_id
+            date=session_date,
+            image_path=image_path
         )
     
     def get_class_sessions(self, class_id: int, limit: Optional[int] = None) -> List[AttendanceSession]:
         """Get attendance sessions for a class"""
-        def _get_sessions(session: Session):
+        with db_manager.session() as session:
             query = session.query(AttendanceSession).filter_by(
                 class_id=class_id
-            ).order_by(desc(AttendanceSession.session_date))
+            ).order_by(desc(AttendanceSession.date))
             if limit:
                 query = query.limit(limit)
             return query.all()
-        
-        return db_manager.execute_with_retry(_get_sessions)
     
     def get_sessions_by_date_range(self, class_id: int, start_date: date, 
                                   end_date: date) -> List[AttendanceSession]:
         """Get sessions within a date range"""
-        def _get_sessions(session: Session):
+        with db_manager.session() as session:
             return session.query(AttendanceSession).filter(
                 and_(
                     AttendanceSession.class_id == class_id,
-                    AttendanceSession.session_date >= start_date,
-                    AttendanceSession.session_date <= end_date
+                    AttendanceSession.date >= start_date,
+                    AttendanceSession.date <= end_date
                 )
-            ).order_by(AttendanceSession.session_date).all()
-        
-        return db_manager.execute_with_retry(_get_sessions)
+            ).order_by(AttendanceSession.date).all()
 
 
 class AttendanceRecordRepository(BaseRepository):
@@ -335,37 +556,93 @@ class AttendanceRecordRepository(BaseRepository):
     def __init__(self):
         super().__init__(AttendanceRecord)
     
+    @staticmethod
+    def _get_session_class_and_date(session: Session, session_id: int):
+        """Get the class and date records of an attendance session take"""
+        return session.execute(
+            select(AttendanceSession.class_id, AttendanceSession.date).where(
+                AttendanceSession.id == session_id
+            )
+        ).one()
+    
     def mark_attendance(self, student_id: int, session_id: int, 
-                       status: str, confidence_score: Optional[float] = None,
-                       detection_method: str = "automatic",
-                       marked_by_user_id: Optional[int] = None) -> AttendanceRecord:
+                       status: str, confidence_score: Optional[float] = None) -> AttendanceRecord:
         """Mark attendance for a student"""
-        try:
-            return self.create(
+        self._invalidate_cache()
+        
+        def _mark(session: Session):
+            # Records take their class and date from the session they belong to
+            class_id, session_date = self._get_session_class_and_date(session, session_id)
+            record = AttendanceRecord(
                 student_id=student_id,
+                class_id=class_id,
                 session_id=session_id,
+                date=session_date,
                 status=status,
-                confidence_score=confidence_score,
-                detection_method=detection_method,
-                marked_by_user_id=marked_by_user_id
+                confidence_score=confidence_score
             )
+            session.add(record)
+            session.flush()  # Get the ID without committing
+            return record
+        
+        try:
+            return db_manager.execute_with_retry(_mark)
         except IntegrityError:
             raise DatabaseError("Attendance already marked for this student in this session")
     
+    def mark_attendance_bulk(self, session_id: int, records: List[Dict[str, Any]],
+                             batch_size: int = 500) -> int:
+        """Mark attendance for many students in a session at once
+        
+        Args:
+            session_id: Attendance session the records belong to
+            records: Dicts with student_id, status and optionally confidence_score
+            batch_size: Maximum number of rows sent per INSERT
+            
+        Returns:
+            Number of records inserted; students already marked in the session
+            are skipped by the uq_att_student_session constraint
+        """
+        if not records:
+            return 0
+        
+        self._invalidate_cache()
+        
+        def _bulk(session: Session):
+            # Records take their class and date from the session they belong to
+            class_id, session_date = self._get_session_class_and_date(session, session_id)
+            rows = [{
+                'student_id': record['student_id'],
+                'class_id': class_id,
+                'session_id': session_id,
+                'date': session_date,
+                'status': record['status'],
+                'confidence_score': record.get('confidence_score')
+            } for record in records]
+            
+            stmt = _insert_ignoring_conflicts(session, AttendanceRecord).returning(AttendanceRecord.id)
+            
+            inserted = 0
+            for start in range(0, len(rows), batch_size):
+                result = session.execute(stmt, rows[start:start + batch_size])
+                inserted += len(result.all())
+            session.flush()
+            return inserted
+        
+        return db_manager.execute_with_retry(_bulk)
+    
     def get_session_attendance(self, session_id: int) -> List[AttendanceRecord]:
         """Get all attendance records for a session"""
-        def _get_attendance(session: Session):
+        with db_manager.session() as session:
             return session.query(AttendanceRecord).filter_by(
                 session_id=session_id
             ).all()
-        
-        return db_manager.execute_with_retry(_get_attendance)
     
     def get_student_attendance(self, student_id: int, class_id: Optional[int] = None,
                              start_date: Optional[date] = None,
                              end_date: Optional[date] = None) -> List[AttendanceRecord]:
         """Get attendance records for a student"""
-        def _get_attendance(session: Session):
+        with db_manager.session() as session:
             query = session.query(AttendanceRecord).join(AttendanceSession).filter(
                 AttendanceRecord.student_id == student_id
             )
@@ -374,32 +651,50 @@ class AttendanceRecordRepository(BaseRepository):
                 query = query.filter(AttendanceSession.class_id == class_id)
             
             if start_date:
-                query = query.filter(AttendanceSession.session_date >= start_date)
+                query = query.filter(AttendanceSession.date >= start_date)
             
             if end_date:
-                query = query.filter(AttendanceSession.session_date <= end_date)
+                query = query.filter(AttendanceSession.date <= end_date)
             
-            return query.order_by(AttendanceSession.session_date).all()
+            return query.order_by(AttendanceSession.date).all()
+    
+    def get_class_attendance_matrix(self, class_id: int, start_date: date,
+                                    end_date: date) -> Dict[int, List[AttendanceRecord]]:
+        """Get a class's attendance records in a date range, grouped by student
+        
+        Loads the whole class in one query instead of one
+        get_student_attendance call per student.
         
-        return db_manager.execute_with_retry(_get_attendance)
+        Returns:
+            Mapping of student ID to that student's records in session order
+        """
+        with db_manager.session() as session:
+            records = session.execute(
+                select(AttendanceRecord).join(AttendanceSession).where(
+                    AttendanceSession.class_id == class_id,
+                    AttendanceSession.date.between(start_date, end_date)
+                ).order_by(AttendanceSession.date)
+            ).scalars().all()
+        
+        matrix: Dict[int, List[AttendanceRecord]] = {}
+        for record in records:
+            matrix.setdefault(record.student_id, []).append(record)
+        return matrix
     
-    def update_attendance(self, student_id: int, session_id: int, 
-                         status: str, notes: Optional[str] = None) -> Optional[AttendanceRecord]:
+    def update_attendance(self, student_id: int, session_id: int,
+                         status: str) -> Optional[AttendanceRecord]:
         """Update existing attendance record"""
+        self._invalidate_cache()
+        
         def _update_attendance(session: Session):
-            record = session.query(AttendanceRecord).filter_by(
-                student_id=student_id,
-                session_id=session_id
-            ).first()
-            
-            if record:
-                record.status = status
-                if notes:
-                    record.notes = notes
-                record.marked_at = datetime.utcnow()
-                session.flush()
-            
-            return record
+            # Single UPDATE ... RETURNING instead of loading the row first;
+            # uq_att_student_session guarantees at most one matching row
+            return session.execute(
+                update(AttendanceRecord).where(
+                    AttendanceRecord.student_id == student_id,
+                    AttendanceRecord.session_id == session_id
+                ).values(status=status).returning(AttendanceRecord)
+            ).scalar_one_or_none()
         
         return db_manager.execute_with_retry(_update_attendance)
 
@@ -414,10 +709,177 @@ class LegacyRepository(BaseRepository):
         """Get all legacy data for migration"""
         return self.get_all()
     
-    def migrate_to_new_structure(self) -> Dict[str, int]:
-        """Migrate legacy data to new structure"""
+    def iter_legacy_data(self, chunk_size: int = 1000) -> Iterator[Add]:
+        """Stream legacy records, fetching chunk_size rows at a time"""
+        with db_manager.session() as session:
+            yield from session.execute(
+                select(Add).execution_options(yield_per=chunk_size)
+            ).scalars()
+    
+    def _fetch_existing(self, session: Session, key_column, value_column,
+                        keys: List[Any]) -> List[Tuple[Any, Any]]:
+        """Fetch (key, value) pairs for rows whose key is in keys
+        
+        Keys are sent in IN lists of at most _IN_BATCH_SIZE bind parameters,
+        keeping each lookup under SQLite's host parameter limit.
+        """
+        pairs = []
+        for start in range(0, len(keys), _IN_BATCH_SIZE):
+            pairs.extend(session.execute(
+                select(key_column, value_column).where(
+                    key_column.in_(keys[start:start + _IN_BATCH_SIZE])
+                )
+            ).tuples())
+        return pairs
+    
+    def _insert_classes(self, session: Session, rows: List[Dict[str, Any]]) -> Tuple[Dict[str, int], int]:
+        """Insert classes that do not exist yet
+        
+        Returns:
+            Mapping of class name to class ID for all rows, and the number
+            of classes actually inserted
+        """
+        if not rows:
+            return {}, 0
+        
+        class_ids = dict(self._fetch_existing(
+            session, Class.name, Class.id, [row['name'] for row in rows]
+        ))
+        
+        new_rows = [row for row in rows if row['name'] not in class_ids]
+        if new_rows:
+            for row in session.execute(insert(Class).returning(Class.id, Class.name), new_rows):
+                class_ids[row.name] = row.id
+        
+        return class_ids, len(new_rows)
+    
+    def _insert_students(self, session: Session, rows: List[Dict[str, Any]]) -> Tuple[Dict[str, int], int]:
+        """Insert students that do not exist yet
+        
+        Returns:
+            Mapping of registration number to student ID for all rows, and
+            the number of students actually inserted
+        """
+        if not rows:
+            return {}, 0
+        
+        student_ids = dict(self._fetch_existing(
+            session, Student.registration_number, Student.id,
+            [row['registration_number'] for row in rows]
+        ))
+        
+        new_rows = [row for row in rows if row['registration_number'] not in student_ids]
+        if new_rows:
+            for row in session.execute(
+                insert(Student).returning(Student.id, Student.registration_number), new_rows
+            ):
+                student_ids[row.registration_number] = row.id
+        
+        return student_ids, len(new_rows)
+    
+    def _insert_enrollments(self, session: Session, rows: List[Dict[str, Any]]) -> int:
+        """Insert class enrollments that do not exist yet in one statement"""
+        if not rows:
+            return 0
+        
+        existing = set(self._fetch_existing(
+            session, ClassEnrollment.student_id, ClassEnrollment.class_id,
+            list({row['student_id'] for row in rows})
+        ))
+        
+        new_rows = [row for row in rows if (row['student_id'], row['class_id']) not in existing]
+        if new_rows:
+            session.execute(insert(ClassEnrollment), new_rows)
+        return len(new_rows)
+    
+    def _migrate_chunk(self, session: Session, legacy_records: List[Add]) -> Dict[str, int]:
+        """Migrate one chunk of legacy records and count the rows inserted"""
+        migrated_counts = {
+            'classes': 0,
+            'students': 0,
+            'enrollments': 0
+        }
+        
+        # Group records by class
+        classes_data = {}
+        for record in legacy_records:
+            if record.classname not in classes_data:
+                classes_data[record.classname] = {
+                    'coordinator': record.coordinator,
+                    'coordinator_email': record.co_email,
+                    'students': []
+                }
+            
+            if record.stuname:  # Only add if student name exists
+                classes_data[record.classname]['students'].append({
+                    'name': record.stuname,
+                    'registration_number': str(record.regno).upper() if record.regno else '',
+                    'phone': str(record.mobileno) if record.mobileno else None
+                })
+        
+        if not classes_data:
+            return migrated_counts
+        
+        try:
+            # All rows are written through this session rather than the
+            # other repositories so the migration commits exactly once.
+            # Rows that already exist are looked up in one query per table
+            # and skipped, so re-running the migration adds nothing
+            class_ids, migrated_counts['classes'] = self._insert_classes(session, [
+                {
+                    'name': class_name,
+                    'coordinator': class_data['coordinator'],
+                    'coordinator_email': (class_data['coordinator_email'] or '').lower()
+                }
+                for class_name, class_data in classes_data.items()
+            ])
+            
+            student_data_by_regno = {}
+            for class_data in classes_data.values():
+                for student_data in class_data['students']:
+                    if student_data['name'] and student_data['registration_number']:
+                        student_data_by_regno.setdefault(student_data['registration_number'], student_data)
+            
+            student_ids, migrated_counts['students'] = self._insert_students(session, [
+                {
+                    'name': student_data['name'],
+                    'registration_number': regno,
+                    'phone': student_data['phone']
+                }
+                for regno, student_data in student_data_by_regno.items()
+            ])
+            
+            enrollment_pairs = {
+                (student_ids[student_data['registration_number']], class_ids[class_name])
+                for class_name, class_data in classes_data.items()
+                for student_data in class_data['students']
+                if student_data['registration_number'] in student_ids
+            }
+            migrated_counts['enrollments'] = self._insert_enrollments(session, [
+                {'student_id': student_id, 'class_id': class_id}
+                for student_id, class_id in enrollment_pairs
+            ])
+        except Exception as e:
+            # Leave no partially migrated classes or students behind
+            session.rollback()
+            logger.error(f"Legacy migration failed, rolled back: {e}")
+            raise
+        
+        return migrated_counts
+    
+    def migrate_to_new_structure(self, chunk_size: int = 1000) -> Dict[str, int]:
+        """Migrate legacy data to new structure
+        
+        Legacy rows are streamed and migrated chunk_size at a time, so memory
+        use is bounded by the chunk rather than the size of the legacy table.
+        """
+        # Rows are written straight through the session, bypassing the
+        # repositories of the tables they land in
+        invalidate_cached_lookups(Class, Student, ClassEnrollment)
+        
         def _migrate(session: Session):
-            legacy_records = session.query(Add).all()
+            # The whole migration is one READ COMMITTED transaction
+            use_read_committed(session)
             
             migrated_counts = {
                 'classes': 0,
@@ -425,77 +887,38 @@ class LegacyRepository(BaseRepository):
                 'enrollments': 0
             }
             
-            class_repo = ClassRepository()
-            student_repo = StudentRepository()
-            enrollment_repo = ClassEnrollmentRepository()
-            
-            # Group records by class
-            classes_data = {}
-            for record in legacy_records:
-                if record.classname not in classes_data:
-                    classes_data[record.classname] = {
-                        'coordinator': record.coordinator,
-                        'coordinator_email': record.co_email,
-                        'students': []
-                    }
-                
-                if record.stuname:  # Only add if student name exists
-                    classes_data[record.classname]['students'].append({
-                        'name': record.stuname,
-                        'registration_number': str(record.regno) if record.regno else '',
-                        'phone': str(record.mobileno) if record.mobileno else None
-                    })
+            legacy_chunks = session.execute(
+                select(Add).execution_options(yield_per=chunk_size)
+            ).scalars().partitions()
             
-            # Create new structure
-            for class_name, class_data in classes_data.items():
-                try:
-                    # Create class
-                    new_class = class_repo.create_class(
-                        name=class_name,
-                        coordinator=class_data['coordinator'],
-                        coordinator_email=class_data['coordinator_email']
-                    )
-                    migrated_counts['classes'] += 1
-                    
-                    # Create students and enroll them
-                    for student_data in class_data['students']:
-                        if student_data['name'] and student_data['registration_number']:
-                            try:
-                                # Check if student already exists
-                                existing_student = student_repo.get_by_registration_number(
-                                    student_data['registration_number']
-                                )
-                                
-                                if not existing_student:
-                                    new_student = student_repo.create_student(
-                                        name=student_data['name'],
-                                        registration_number=student_data['registration_number'],
-                                        phone=student_data['phone']
-                                    )
-                                    migrated_counts['students'] += 1
-                                else:
-                                    new_student = existing_student
-                                
-                                # Enroll student in class
-                                enrollment_repo.enroll_student(new_student.id, new_class.id)
-                                migrated_counts['enrollments'] += 1
-                                
-                            except Exception as e:
-                                logger.warning(f"Failed to migrate student {student_data['name']}: {e}")
-                
-                except Exception as e:
-                    logger.warning(f"Failed to migrate class {class_name}: {e}")
+            for legacy_records in legacy_chunks:
+                for key, count in self._migrate_chunk(session, legacy_records).items():
+                    migrated_counts[key] += count
             
             return migrated_counts
         
         return db_manager.execute_with_retry(_migrate)
 
 
-# Repository instances
-user_repo = UserRepository()
-student_repo = StudentRepository()
-class_repo = ClassRepository()
-enrollment_repo = ClassEnrollmentRepository()
-session_repo = AttendanceSessionRepository()
-attendance_repo = AttendanceRecordRepository()
-legacy_repo = LegacyRepository()
\ No newline at end of file
+# Repository instances, created on first access rather than at import time
+_REPOSITORY_CLASSES = {
+    'user_repo': UserRepository,
+    'student_repo': StudentRepository,
+    'class_repo': ClassRepository,
+    'enrollment_repo': ClassEnrollmentRepository,
+    'session_repo': AttendanceSessionRepository,
+    'attendance_repo': AttendanceRecordRepository,
+    'legacy_repo': LegacyRepository,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_repository(name: str) -> BaseRepository:
+    """Get the shared repository instance with the given name"""
+    return _REPOSITORY_CLASSES[name]()
+
+
+def __getattr__(name: str):
+    if name in _REPOSITORY_CLASSES:
+        return get_repository(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
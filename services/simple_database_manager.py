@@ -3,9 +3,12 @@ Simplified Database Manager for the attendance system
 """
 
 import logging
-from typing import List, Optional, Dict, Any
+from functools import cached_property
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime
+from contextlib import contextmanager
 import sqlite3
+import threading
 from pathlib import Path
 
 # Import configuration
@@ -16,6 +19,16 @@ from config.configuration_manager import config_manager
 
 logger = logging.getLogger(__name__)
 
+# Applied once to the shared connection: WAL lets readers proceed during
+# writes and, with synchronous=NORMAL, avoids an fsync per statement
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+)
+
 
 class SimpleDatabaseManager:
     """Simplified database manager for basic operations"""
@@ -23,13 +36,46 @@ class SimpleDatabaseManager:
     def __init__(self):
         self.db_url = config_manager.get_database_url()
         self.db_path = self.db_url.replace('sqlite:///', '') if self.db_url.startswith('sqlite:///') else None
+        self._legacy_cache: Optional[Tuple[tuple, Dict[str, Any]]] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_lock = threading.RLock()
+    
+    @cached_property
+    def _app_db(self):
+        """Flask app and db, imported on first use to avoid circular imports"""
+        from attendance import app, db
+        return app, db
+    
+    @cached_property
+    def _models(self):
+        """Legacy and new ORM models, imported on first use"""
+        from attendance.models import Add, Student, Class, ClassEnrollment
+        return Add, Student, Class, ClassEnrollment
+    
+    def _get_file_stamp(self) -> tuple:
+        """Get modification stamps of the database file and its WAL file"""
+        stamp = []
+        for path in (Path(self.db_path), Path(f"{self.db_path}-wal")):
+            if path.exists():
+                stat = path.stat()
+                stamp.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(stamp)
     
+    @contextmanager
     def get_connection(self):
-        """Get database connection"""
+        """Get the shared database connection, held exclusively by the caller"""
         if not self.db_path:
             raise ValueError("Only SQLite databases are supported")
         
-        return sqlite3.connect(self.db_path)
+        with self._conn_lock:
+            # Opened on first use so importing this module never creates the file
+            if self._conn is None:
+                conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+                for pragma in CONNECTION_PRAGMAS:
+                    conn.execute(pragma)
+                self._conn = conn
+            
+            yield self._conn
     
     def health_check(self) -> bool:
         """Check database connection health"""
@@ -41,14 +87,16 @@ class SimpleDatabaseManager:
             logger.error(f"Database health check failed: {e}")
             return False
     
-    def create_tables(self):
-        """Create database tables using Flask-SQLAlchemy"""
+    def create_tables(self, bind=None):
+        """Create database tables using Flask-SQLAlchemy, optionally on another engine or connection"""
         try:
-            # Import here to avoid circular imports
-            from attendance import app, db
+            app, db = self._app_db
             
             with app.app_context():
-                db.create_all()
+                if bind is None:
+                    db.create_all()
+                else:
+                    db.metadata.create_all(bind)
                 logger.info("Database tables created successfully")
         except Exception as e:
             logger.error(f"Failed to create database tables: {e}")
@@ -63,38 +111,51 @@ class SimpleDatabaseManager:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
-                # Check if legacy 'add' table exists
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='add'")
-                legacy_table_exists = cursor.fetchone() is not None
+                # Reuse the last result while neither the schema nor the
+                # database files have changed, skipping the COUNT(*) scan
+                cursor.execute("PRAGMA schema_version")
+                cache_key = (cursor.fetchone()[0], self._get_file_stamp())
+                if self._legacy_cache and self._legacy_cache[0] == cache_key:
+                    return dict(self._legacy_cache[1])
+                
+                # Check for the legacy 'add' table and the new tables in one lookup
+                cursor.execute(
+                    "SELECT name FROM sqlite_master WHERE type='table' AND name IN ('add', 'student')"
+                )
+                tables = {row[0] for row in cursor.fetchall()}
+                legacy_table_exists = 'add' in tables
+                new_tables_exist = 'student' in tables
                 
                 legacy_count = 0
                 if legacy_table_exists:
                     cursor.execute("SELECT COUNT(*) FROM 'add'")
                     legacy_count = cursor.fetchone()[0]
                 
-                # Check if new tables exist
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='student'")
-                new_tables_exist = cursor.fetchone() is not None
-                
-                return {
+                result = {
                     'legacy_records': legacy_count,
                     'new_schema_exists': new_tables_exist,
                     'legacy_table_exists': legacy_table_exists
                 }
+                self._legacy_cache = (cache_key, result)
+                return dict(result)
         
         except Exception as e:
             logger.error(f"Failed to check legacy data: {e}")
             return {'error': str(e)}
     
-    def migrate_legacy_data(self):
+    def migrate_legacy_data(self, session=None):
         """Migrate data from legacy Add model to new models"""
         try:
-            from attendance import app, db
-            from attendance.models import Add, Student, Class, ClassEnrollment
+            from sqlalchemy import select
+            app, db = self._app_db
+            Add, Student, Class, ClassEnrollment = self._models
             
             with app.app_context():
+                if session is None:
+                    session = db.session
+                
                 # Get all legacy records
-                legacy_records = Add.query.all()
+                legacy_records = session.scalars(select(Add)).all()
                 
                 if not legacy_records:
                     logger.info("No legacy data to migrate")
@@ -117,44 +178,59 @@ class SimpleDatabaseManager:
                             'mobile': str(record.mobileno) if record.mobileno else None
                         })
                 
-                # Create new records
-                for class_name, class_data in classes_data.items():
-                    # Create class
-                    new_class = Class(
-                        name=class_name,
-                        coordinator=class_data['coordinator'] or 'Unknown',
-                        coordinator_email=class_data['co_email'] or 'unknown@example.com'
+                # Insert everything with one executemany per table inside a
+                # single transaction instead of a flush per row
+                class_rows = [
+                    {
+                        'name': class_name,
+                        'coordinator': class_data['coordinator'] or 'Unknown',
+                        'coordinator_email': class_data['co_email'] or 'unknown@example.com'
+                    }
+                    for class_name, class_data in classes_data.items()
+                ]
+                class_ids = {
+                    row.name: row.id
+                    for row in session.execute(
+                        Class.__table__.insert().returning(Class.id, Class.name), class_rows
                     )
-                    db.session.add(new_class)
-                    db.session.flush()  # Get the ID
-                    
-                    # Create students and enrollments
+                }
+                
+                # Existing students are loaded once and matched in memory
+                student_ids = dict(session.execute(
+                    select(Student.registration_number, Student.id)
+                ).all())
+                
+                new_students = {}
+                for class_data in classes_data.values():
                     for student_data in class_data['students']:
-                        # Check if student already exists
-                        existing_student = Student.query.filter_by(
-                            registration_number=student_data['regno']
-                        ).first()
-                        
-                        if not existing_student:
-                            new_student = Student(
-                                name=student_data['name'],
-                                registration_number=student_data['regno'],
-                                phone=student_data['mobile']
-                            )
-                            db.session.add(new_student)
-                            db.session.flush()
-                            student_id = new_student.id
-                        else:
-                            student_id = existing_student.id
-                        
-                        # Create enrollment
-                        enrollment = ClassEnrollment(
-                            student_id=student_id,
-                            class_id=new_class.id
+                        if student_data['regno'] not in student_ids:
+                            new_students.setdefault(student_data['regno'], {
+                                'name': student_data['name'],
+                                'registration_number': student_data['regno'],
+                                'phone': student_data['mobile']
+                            })
+                
+                if new_students:
+                    student_ids.update(
+                        (row.registration_number, row.id)
+                        for row in session.execute(
+                            Student.__table__.insert().returning(Student.registration_number, Student.id),
+                            list(new_students.values())
                         )
-                        db.session.add(enrollment)
+                    )
+                
+                enrollment_rows = [
+                    {
+                        'student_id': student_ids[student_data['regno']],
+                        'class_id': class_ids[class_name]
+                    }
+                    for class_name, class_data in classes_data.items()
+                    for student_data in class_data['students']
+                ]
+                if enrollment_rows:
+                    session.execute(ClassEnrollment.__table__.insert(), enrollment_rows)
                 
-                db.session.commit()
+                session.commit()
                 logger.info(f"Migrated {len(classes_data)} classes with students")
             
         except Exception as e:
@@ -163,14 +239,14 @@ class SimpleDatabaseManager:
     
     def get_migration_status(self) -> Dict[str, Any]:
         """Get current migration status"""
+        if not self.db_path:
+            return {'error': 'No SQLite database path configured'}
+        
         try:
             status = {}
             
-            # Check if database exists
-            if self.db_path:
-                status['database_exists'] = Path(self.db_path).exists()
-            else:
-                status['database_exists'] = self.health_check()
+            # Check if database exists; a corrupt file is reported by check_legacy_data
+            status['database_exists'] = Path(self.db_path).exists()
             
             # Check legacy data
             legacy_info = self.check_legacy_data()
@@ -211,14 +287,26 @@ class SimpleDatabaseManager:
             else:
                 logger.info(f"Found {legacy_info['legacy_records']} legacy records to migrate")
             
-            # Create new tables
-            logger.info("Creating new database schema...")
-            self.create_tables()
-            
-            # Migrate legacy data if it exists
-            if legacy_info.get('legacy_records', 0) > 0:
-                logger.info("Migrating legacy data...")
-                self.migrate_legacy_data()
+            if not self.db_path:
+                self._apply_migration(legacy_info)
+            else:
+                # Migrate in place inside one BEGIN IMMEDIATE transaction on the
+                # shared connection, so the file is synced once and the write
+                # lock is held from the start instead of taken per commit
+                from sqlalchemy import create_engine, event
+                from sqlalchemy.pool import StaticPool
+                
+                with self.get_connection() as conn:
+                    engine = create_engine('sqlite://', creator=lambda: conn, poolclass=StaticPool)
+                    
+                    # The connection runs with isolation_level=None, so the
+                    # driver never emits BEGIN itself
+                    @event.listens_for(engine, "begin")
+                    def _begin_immediate(connection):
+                        connection.exec_driver_sql("BEGIN IMMEDIATE")
+                    
+                    with engine.begin() as connection:
+                        self._apply_migration(legacy_info, connection)
             
             logger.info("Migration completed successfully!")
             return True
@@ -227,6 +315,25 @@ class SimpleDatabaseManager:
             logger.error(f"Migration failed: {e}")
             return False
     
+    def _apply_migration(self, legacy_info: Dict[str, Any], connection=None):
+        """Create the new tables and move legacy data, on the app database or the given connection"""
+        from sqlalchemy.orm import Session
+        
+        # Create new tables
+        logger.info("Creating new database schema...")
+        self.create_tables(connection)
+        
+        # Migrate legacy data if it exists
+        if legacy_info.get('legacy_records', 0) > 0:
+            logger.info("Migrating legacy data...")
+            if connection is None:
+                self.migrate_legacy_data()
+            else:
+                # The session joins the caller's transaction; its commit does
+                # not end it
+                with Session(connection) as session:
+                    self.migrate_legacy_data(session)
+    
     def verify_migration(self) -> Dict[str, Any]:
         """Verify that migration was successful"""
         try:
@@ -237,8 +344,8 @@ class SimpleDatabaseManager:
             
             # Check table existence and counts
             try:
-                from attendance import app
-                from attendance.models import Student, Class
+                app, _ = self._app_db
+                _, Student, Class, _ = self._models
                 
                 with app.app_context():
                     student_count = Student.query.count()
@@ -12,23 +12,40 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def run_command(cmd, check=True):
-    """Run a shell command"""
+    """Run a command given as an argument list, without a shell"""
     try:
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, check=check)
+        result = subprocess.run(cmd, capture_output=True, text=True, check=check)
         return result.returncode == 0, result.stdout, result.stderr
     except subprocess.CalledProcessError as e:
         return False, e.stdout, e.stderr
+    except FileNotFoundError as e:
+        return False, "", str(e)
 
-def check_git_installed():
-    """Check if git is installed"""
-    success, stdout, stderr = run_command("git --version", check=False)
-    if success:
-        logger.info(f"✓ Git is installed: {stdout.strip()}")
-        return True
-    else:
+def read_git_config():
+    """Read the whole git configuration with a single git call
+    
+    Also serves as the git installation check.
+    
+    Returns:
+        Dict of config keys to values, or None if git is not installed
+    """
+    try:
+        result = subprocess.run(["git", "config", "--list", "--null"], capture_output=True, text=True)
+    except FileNotFoundError:
         logger.error("✗ Git is not installed")
         logger.info("Please install Git from: https://git-scm.com/downloads")
-        return False
+        return None
+    
+    logger.info("✓ Git is installed")
+    
+    # Entries are NUL-terminated, with a newline between key and value;
+    # later entries (e.g. repository config) override earlier ones
+    config = {}
+    for entry in result.stdout.split("\0"):
+        if entry:
+            key, _, value = entry.partition("\n")
+            config[key] = value
+    return config
 
 def initialize_git():
     """Initialize git repository"""
@@ -37,7 +54,7 @@ def initialize_git():
         return True
     
     logger.info("Initializing Git repository...")
-    success, stdout, stderr = run_command("git init")
+    success, stdout, stderr = run_command(["git", "init"])
     
     if success:
         logger.info("✓ Git repository initialized")
@@ -60,7 +77,7 @@ def add_files():
     logger.info("Adding files to Git...")
     
     # Add all files
-    success, stdout, stderr = run_command("git add .")
+    success, stdout, stderr = run_command(["git", "add", "."])
     
     if success:
         logger.info("✓ Files added to Git")
@@ -74,7 +91,7 @@ def create_initial_commit():
     logger.info("Creating initial commit...")
     
     # Check if there are changes to commit
-    success, stdout, stderr = run_command("git status --porcelain")
+    success, stdout, stderr = run_command(["git", "status", "--porcelain"])
     
     if not stdout.strip():
         logger.info("✓ No changes to commit (repository is clean)")
@@ -82,7 +99,7 @@ def create_initial_commit():
     
     # Create commit
     commit_message = "Initial commit: Modernized FaceNet Attendance System"
-    success, stdout, stderr = run_command(f'git commit -m "{commit_message}"')
+    success, stdout, stderr = run_command(["git", "commit", "-m", commit_message])
     
     if success:
         logger.info(f"✓ Initial commit created: {commit_message}")
@@ -91,25 +108,23 @@ def create_initial_commit():
         logger.error(f"✗ Failed to create commit: {stderr}")
         return False
 
-def configure_git_user():
+def configure_git_user(git_config):
     """Configure git user if not set"""
     # Check if user.name is set
-    success, stdout, stderr = run_command("git config user.name", check=False)
-    
-    if not stdout.strip():
+    if not git_config.get("user.name", "").strip():
         logger.warning("Git user.name not configured")
         logger.info("Please configure with: git config --global user.name \"Your Name\"")
         return False
     
     # Check if user.email is set
-    success, stdout, stderr = run_command("git config user.email", check=False)
+    user_email = git_config.get("user.email", "").strip()
     
-    if not stdout.strip():
+    if not user_email:
         logger.warning("Git user.email not configured")
         logger.info("Please configure with: git config --global user.email \"your.email@example.com\"")
         return False
     
-    logger.info(f"✓ Git user configured: {stdout.strip()}")
+    logger.info(f"✓ Git user configured: {user_email}")
     return True
 
 def show_git_status():
@@ -117,7 +132,7 @@ def show_git_status():
     logger.info("\nCurrent Git Status:")
     logger.info("=" * 50)
     
-    success, stdout, stderr = run_command("git status")
+    success, stdout, stderr = run_command(["git", "status"])
     
     if success:
         print(stdout)
@@ -221,7 +236,8 @@ def main():
     logger.info("=" * 50)
     
     # Check if git is installed
-    if not check_git_installed():
+    git_config = read_git_config()
+    if git_config is None:
         return
     
     # Initialize repository
@@ -233,7 +249,7 @@ def main():
         logger.warning("Please create .gitignore file")
     
     # Configure git user
-    user_configured = configure_git_user()
+    user_configured = configure_git_user(git_config)
     
     # Add files
     if add_files():
@@ -0,0 +1,24 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+# Import the app without its routes, which load the FaceNet model
+os.environ.setdefault('ATTENDANCE_SKIP_ROUTES', '1')
+
+
+@pytest.fixture
+def session(monkeypatch):
+    """Point the shared manager at an in-memory database with the real schema"""
+    from models.database_models import db
+    from services.database_manager import db_manager
+
+    engine = create_engine("sqlite://")
+    db.metadata.create_all(engine)
+    scoped = scoped_session(sessionmaker(engine))
+    monkeypatch.setattr(db_manager, "db", SimpleNamespace(session=scoped))
+    yield scoped
+    scoped.remove()
+    engine.dispose()
@@ -1,5 +1,6 @@
 import os
 import pytest
+from contextlib import contextmanager
 from hypothesis import given, strategies as st
 from pathlib import Path
 from config.configuration_manager import ConfigurationManager, SystemConfig
@@ -20,6 +21,18 @@ def system_config_strategy(draw):
         debug=draw(st.booleans())
     )
 
+# Shared manager for the property tests; each example only re-reads the environment
+_BASE_CM = ConfigurationManager(config_file="non_existent.ini")
+
+@contextmanager
+def _with_env(env):
+    """Set environment variables and reload the shared manager, restoring them afterwards"""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        for name, value in env.items():
+            monkeypatch.setenv(name, str(value))
+        _BASE_CM.reload()
+        yield _BASE_CM
+
 def test_default_configuration():
     """Test that default configuration is valid"""
     config_manager = ConfigurationManager(config_file="non_existent.ini")
@@ -35,52 +48,37 @@ def test_default_configuration():
        st.integers(min_value=1))
 def test_valid_thresholds_and_size(detection_threshold, recognition_threshold, max_size):
     """Test configuration validation with valid values"""
-    # Mock environment variables
-    os.environ["FACE_DETECTION_THRESHOLD"] = str(detection_threshold)
-    os.environ["RECOGNITION_THRESHOLD"] = str(recognition_threshold)
-    os.environ["MAX_FILE_SIZE"] = str(max_size)
-    
-    config_manager = ConfigurationManager(config_file="non_existent.ini")
-    config = config_manager.config
+    with _with_env({
+        "FACE_DETECTION_THRESHOLD": detection_threshold,
+        "RECOGNITION_THRESHOLD": recognition_threshold,
+        "MAX_FILE_SIZE": max_size
+    }) as config_manager:
+        config = config_manager.config
     
     assert config.face_detection_threshold == detection_threshold
     assert config.recognition_threshold == recognition_threshold
     assert config.max_file_size == max_size
-    
-    # Cleanup
-    del os.environ["FACE_DETECTION_THRESHOLD"]
-    del os.environ["RECOGNITION_THRESHOLD"]
-    del os.environ["MAX_FILE_SIZE"]
 
 @given(st.floats(max_value=-0.0001) | st.floats(min_value=1.0001))
 def test_invalid_detection_threshold(threshold):
     """Test that invalid detection thresholds raise ValueError"""
-    os.environ["FACE_DETECTION_THRESHOLD"] = str(threshold)
-    
     with pytest.raises(ValueError):
-        ConfigurationManager(config_file="non_existent.ini")
-        
-    del os.environ["FACE_DETECTION_THRESHOLD"]
+        with _with_env({"FACE_DETECTION_THRESHOLD": threshold}):
+            pass
 
 @given(st.floats(max_value=-0.0001) | st.floats(min_value=1.0001))
 def test_invalid_recognition_threshold(threshold):
     """Test that invalid recognition thresholds raise ValueError"""
-    os.environ["RECOGNITION_THRESHOLD"] = str(threshold)
-    
     with pytest.raises(ValueError):
-        ConfigurationManager(config_file="non_existent.ini")
-
-    del os.environ["RECOGNITION_THRESHOLD"]
+        with _with_env({"RECOGNITION_THRESHOLD": threshold}):
+            pass
 
 @given(st.integers(max_value=0))
 def test_invalid_max_file_size(size):
     """Test that non-positive file sizes raise ValueError"""
-    os.environ["MAX_FILE_SIZE"] = str(size)
-    
     with pytest.raises(ValueError):
-        ConfigurationManager(config_file="non_existent.ini")
-
-    del os.environ["MAX_FILE_SIZE"]
+        with _with_env({"MAX_FILE_SIZE": size}):
+            pass
 
 def test_environment_precedence(tmp_path):
     """Test that environment variables take precedence over config file"""
@@ -100,3 +98,17 @@ detection_threshold = 0.5
     assert config_manager.config.face_detection_threshold == 0.8
     
     del os.environ["FACE_DETECTION_THRESHOLD"]
+
+def test_database_pool_options_from_environment():
+    """Test that connection pool settings are read from the environment"""
+    os.environ["DB_POOL_SIZE"] = "4"
+    os.environ["DB_POOL_PRE_PING"] = "False"
+    
+    options = ConfigurationManager(config_file="non_existent.ini").get_database_engine_options()
+    
+    assert options["pool_size"] == 4
+    assert options["pool_pre_ping"] is False
+    assert options["max_overflow"] == 20
+    
+    del os.environ["DB_POOL_SIZE"]
+    del os.environ["DB_POOL_PRE_PING"]
@@ -0,0 +1,19 @@
+from models.database_models import Add, Class
+from utils.database_migrations import migration_manager
+
+
+def test_migration_status_reports_counts(session):
+    """Test that the status check succeeds and flags unmigrated legacy data"""
+    session.add(Add(classname="Physics", stuname="Alice", regno=1001))
+    session.commit()
+
+    status = migration_manager.get_migration_status()
+
+    assert status["status"] == "success"
+    assert status["legacy_records"] == 1
+    assert status["current_counts"]["classes"] == 0
+    assert status["migration_needed"] is True
+
+    session.add(Class(name="Physics", coordinator="Dr. Brown", coordinator_email="brown@example.com"))
+    session.commit()
+    assert migration_manager.get_migration_status()["migration_needed"] is False
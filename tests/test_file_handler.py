@@ -0,0 +1,51 @@
+from io import BytesIO
+from werkzeug.datastructures import FileStorage
+from services.file_handler import FileHandler
+
+JPEG_HEADER = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x01\x00H\x00H\x00\x00\xff\xdb\x00C\x00'
+
+
+def make_upload(filename, data):
+    return FileStorage(stream=BytesIO(data), filename=filename, content_type='image/jpeg')
+
+
+def test_valid_jpeg_passes():
+    """Test that a well-formed JPEG upload is accepted"""
+    handler = FileHandler()
+    result = handler.validate_upload(make_upload("photo.jpg", JPEG_HEADER + b'\x00' * 512 + b'\xff\xd9'))
+
+    assert result.is_valid
+    assert result.file_info['detected_mime_type'] == 'image/jpeg'
+
+
+def test_rejected_upload_skips_content_read(monkeypatch):
+    """Test that cheap checks short-circuit before the file header is read"""
+    handler = FileHandler()
+
+    def fail_read(*args, **kwargs):
+        raise AssertionError("file content should not be read")
+
+    monkeypatch.setattr(handler, '_read_header', fail_read)
+
+    for upload in (make_upload("empty.jpg", b''),
+                   make_upload("shell.php", JPEG_HEADER),
+                   make_upload("../../etc/passwd.jpg", JPEG_HEADER)):
+        result = handler.validate_upload(upload)
+        assert not result.is_valid
+
+
+def test_malicious_signature_rejected():
+    """Test that executable headers disguised as images are rejected"""
+    handler = FileHandler()
+    result = handler.validate_upload(make_upload("malicious.jpg", b'\x4d\x5a' + b'\x00' * 1022))
+
+    assert not result.is_valid
+
+
+def test_non_nfc_filename_warns():
+    """Test that decomposed Unicode filenames are flagged"""
+    handler = FileHandler()
+    result = handler.validate_upload(make_upload("cafe\u0301.jpg", JPEG_HEADER + b'\x00' * 512 + b'\xff\xd9'))
+
+    assert result.is_valid
+    assert "Filename not in NFC form" in result.warnings
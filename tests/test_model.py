@@ -8,9 +8,14 @@ import sys
 import pickle
 import cv2
 import numpy as np
-import tensorflow as tf
+import tensorflow.compat.v1 as tf
+tf.disable_v2_behavior()
 from pathlib import Path
 import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 # Add the facenet src to path
 sys.path.append('attendance/facenet/src')
@@ -23,14 +28,27 @@ except ImportError as e:
     print("Make sure you're running from the project root directory")
     sys.exit(1)
 
+# Optional: ONNX Runtime serves the embedding model when available
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Number of images decoded ahead of the one being recognized
+DECODE_AHEAD = 4
+
 class ModelTester:
     def __init__(self):
         self.project_root = Path(__file__).parent
         self.model_dir = self.project_root / "attendance/facenet/src/20180402-114759"
         self.classifier_path = self.model_dir / "my_classifier.pkl"
+        self.onnx_model_path = self.model_dir / "facenet.onnx"
+        self.int8_model_path = self.model_dir / "facenet.int8.onnx"
+        self.saved_model_dir = self.model_dir / "saved_model"
+        self.ort_session = None
         self.test_images_dir = self.project_root / "attendance/facenet/dataset/test-images"
         
     def load_model(self):
@@ -50,13 +68,19 @@ class ModelTester:
         npy = ""
         self.pnet, self.rnet, self.onet = detect_face.create_mtcnn(self.sess, npy)
         
-        # Load FaceNet model
-        facenet.load_model(str(self.model_dir))
-        
-        # Get input and output tensors
-        self.images_placeholder = tf.get_default_graph().get_tensor_by_name("input:0")
-        self.embeddings = tf.get_default_graph().get_tensor_by_name("embeddings:0")
-        self.phase_train_placeholder = tf.get_default_graph().get_tensor_by_name("phase_train:0")
+        # Load FaceNet model, preferring the ONNX export when it can be used
+        # and the SavedModel export over the original checkpoint
+        if not self._load_onnx_model() and not self._load_saved_model():
+            facenet.load_model(str(self.model_dir))
+            
+            # Get input and output tensors
+            self.images_placeholder = tf.get_default_graph().get_tensor_by_name("input:0")
+            self.embeddings = tf.get_default_graph().get_tensor_by_name("embeddings:0")
+            self.phase_train_placeholder = tf.get_default_graph().get_tensor_by_name("phase_train:0")
+            
+            self._export_saved_model()
+            if self._export_onnx_model():
+                self._load_onnx_model()
         
         # Load classifier
         with open(self.classifier_path, 'rb') as infile:
@@ -67,6 +91,118 @@ class ModelTester:
         
         return True
     
+    def _load_onnx_model(self):
+        """Load the ONNX FaceNet export into ONNX Runtime if possible"""
+        if onnxruntime is None or not self.onnx_model_path.exists():
+            return False
+        
+        model_path = self.onnx_model_path
+        # Without a GPU the INT8 model is faster; CUDA runs FP32 convolutions better
+        if "CUDAExecutionProvider" not in onnxruntime.get_available_providers():
+            if self.int8_model_path.exists() or self._quantize_onnx_model():
+                model_path = self.int8_model_path
+        
+        self.ort_session = onnxruntime.InferenceSession(
+            str(model_path),
+            providers=["CUDAExecutionProvider", "CPUExecutionProvider"]
+        )
+        logger.info(f"Using ONNX Runtime embedding model: {model_path}")
+        return True
+    
+    def _load_saved_model(self):
+        """Load the SavedModel FaceNet export into the current session if present"""
+        if not self.saved_model_dir.exists():
+            return False
+        
+        try:
+            meta_graph = tf.saved_model.loader.load(
+                self.sess, [tf.saved_model.tag_constants.SERVING], str(self.saved_model_dir)
+            )
+            signature = meta_graph.signature_def[
+                tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY
+            ]
+            graph = self.sess.graph
+            self.images_placeholder = graph.get_tensor_by_name(signature.inputs["images"].name)
+            self.phase_train_placeholder = graph.get_tensor_by_name(signature.inputs["phase_train"].name)
+            self.embeddings = graph.get_tensor_by_name(signature.outputs["embeddings"].name)
+        except Exception as e:
+            logger.warning(f"Could not load SavedModel, using the checkpoint: {e}")
+            return False
+        
+        logger.info(f"Using SavedModel embedding model: {self.saved_model_dir}")
+        return True
+    
+    def _export_saved_model(self):
+        """Save the loaded FaceNet graph as a SavedModel with a serving signature"""
+        try:
+            tf.saved_model.simple_save(
+                self.sess,
+                str(self.saved_model_dir),
+                inputs={"images": self.images_placeholder, "phase_train": self.phase_train_placeholder},
+                outputs={"embeddings": self.embeddings}
+            )
+        except Exception as e:
+            logger.warning(f"SavedModel export failed: {e}")
+            return False
+        
+        logger.info(f"Exported FaceNet model to {self.saved_model_dir}")
+        return True
+    
+    def _quantize_onnx_model(self):
+        """Create an INT8 weight-quantized copy of the ONNX FaceNet model"""
+        try:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            
+            quantize_dynamic(
+                str(self.onnx_model_path),
+                str(self.int8_model_path),
+                weight_type=QuantType.QInt8
+            )
+        except Exception as e:
+            logger.warning(f"INT8 quantization failed, using the FP32 model: {e}")
+            return False
+        
+        logger.info(f"Quantized FaceNet model to {self.int8_model_path}")
+        return True
+    
+    def _export_onnx_model(self):
+        """Convert the loaded TensorFlow FaceNet graph to ONNX"""
+        if onnxruntime is None:
+            return False
+        
+        try:
+            import tf2onnx
+        except ImportError:
+            logger.info("tf2onnx not installed, keeping the TensorFlow embedding model")
+            return False
+        
+        try:
+            frozen_graph = tf.graph_util.convert_variables_to_constants(
+                self.sess, tf.get_default_graph().as_graph_def(), ["embeddings"]
+            )
+            tf2onnx.convert.from_graph_def(
+                frozen_graph,
+                input_names=["input:0", "phase_train:0"],
+                output_names=["embeddings:0"],
+                output_path=str(self.onnx_model_path)
+            )
+        except Exception as e:
+            logger.warning(f"ONNX export failed, keeping the TensorFlow embedding model: {e}")
+            return False
+        
+        logger.info(f"Exported FaceNet model to {self.onnx_model_path}")
+        return True
+    
+    def _embed(self, faces):
+        """Compute embeddings for a batch of prewhitened faces"""
+        if self.ort_session is not None:
+            return self.ort_session.run(
+                ["embeddings:0"], {"input:0": faces, "phase_train:0": np.array(False)}
+            )[0]
+        
+        feed_dict = {self.images_placeholder: faces, self.phase_train_placeholder: False}
+        return self.sess.run(self.embeddings, feed_dict=feed_dict)
+    
     def recognize_face(self, image_path):
         """Recognize faces in an image"""
         logger.info(f"Processing image: {image_path}")
@@ -77,7 +213,12 @@ class ModelTester:
             logger.error(f"Could not read image: {image_path}")
             return []
         
-        # Convert to RGB
+        return self.recognize_frame(frame)
+    
+    def recognize_frame(self, frame):
+        """Recognize faces in an already decoded BGR frame"""
+        # Convert to RGB; MTCNN needs three channels, and dropping an alpha
+        # channel is only a view
         if frame.ndim == 2:
             frame = facenet.to_rgb(frame)
         frame = frame[:, :, 0:3]
@@ -87,7 +228,16 @@ class ModelTester:
         threshold = [0.6, 0.7, 0.7]
         factor = 0.709
         
-        bounding_boxes, _ = detect_face.detect_face(frame, minsize, self.pnet, self.rnet, self.onet, threshold, factor)
+        # Run the detector on a copy no larger than 640px and map the boxes
+        # back; P-net cost grows with the square of the image size
+        height, width = frame.shape[:2]
+        scale = min(1.0, 640.0 / max(height, width))
+        if scale < 1.0:
+            det_frame = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        else:
+            det_frame = frame
+        
+        bounding_boxes, _ = detect_face.detect_face(det_frame, minsize, self.pnet, self.rnet, self.onet, threshold, factor)
         nrof_faces = bounding_boxes.shape[0]
         
         logger.info(f"Detected {nrof_faces} faces")
@@ -95,65 +245,72 @@ class ModelTester:
         results = []
         
         if nrof_faces > 0:
-            det = bounding_boxes[:, 0:4]
-            img_size = np.asarray(frame.shape)[0:2]
+            if scale < 1.0:
+                bounding_boxes[:, 0:4] /= scale
+            det = bounding_boxes[:, 0:4].astype(np.int32)
             
-            for i in range(nrof_faces):
-                # Extract face region
-                bb = det[i].astype(int)
-                
-                # Check bounds
-                if bb[0] <= 0 or bb[1] <= 0 or bb[2] >= frame.shape[1] or bb[3] >= frame.shape[0]:
-                    logger.warning(f"Face {i} is too close to image boundary, skipping")
-                    continue
-                
-                # Crop and preprocess face
+            # Check bounds for all faces at once
+            valid = (det[:, 0] > 0) & (det[:, 1] > 0) & (det[:, 2] < width) & (det[:, 3] < height)
+            for i in np.flatnonzero(~valid):
+                logger.warning(f"Face {i} is too close to image boundary, skipping")
+            face_indices = np.flatnonzero(valid)
+            boxes = det[valid]
+            
+            # Crop every usable face first so all of them are embedded and
+            # classified in a single batch
+            faces = np.empty((len(boxes), 160, 160, 3), dtype=np.float32)
+            
+            for j, bb in enumerate(boxes):
+                # Crop and resize face to 160x160
                 cropped = frame[bb[1]:bb[3], bb[0]:bb[2], :]
-                cropped = facenet.flip(cropped, False)
-                
-                # Resize to 160x160
-                scaled = cv2.resize(cropped, (160, 160), interpolation=cv2.INTER_CUBIC)
-                scaled = facenet.prewhiten(scaled)
-                scaled = scaled.reshape(-1, 160, 160, 3)
+                faces[j] = cv2.resize(cropped, (160, 160), interpolation=cv2.INTER_CUBIC)
+            
+            if len(boxes):
+                # Prewhiten the whole batch in place, same as facenet.prewhiten
+                # per face but without a temporary array for every step
+                mean = faces.mean(axis=(1, 2, 3), keepdims=True, dtype=np.float64)
+                std = faces.std(axis=(1, 2, 3), keepdims=True, dtype=np.float64)
+                np.maximum(std, 1.0 / np.sqrt(faces[0].size), out=std)
+                faces -= mean
+                faces /= std
                 
-                # Get embedding
-                feed_dict = {self.images_placeholder: scaled, self.phase_train_placeholder: False}
-                emb_array = self.sess.run(self.embeddings, feed_dict=feed_dict)
+                # Get embeddings
+                emb_array = self._embed(faces)
                 
                 # Classify
                 predictions = self.model.predict_proba(emb_array)
                 best_class_indices = np.argmax(predictions, axis=1)
                 best_class_probabilities = predictions[np.arange(len(best_class_indices)), best_class_indices]
                 
-                # Get result
-                class_name = self.class_names[best_class_indices[0]]
-                confidence = best_class_probabilities[0]
-                
-                results.append({
-                    'name': class_name,
-                    'confidence': confidence,
-                    'bbox': bb
-                })
-                
-                logger.info(f"Face {i}: {class_name} (confidence: {confidence:.3f})")
+                # Get results
+                for i, bb, class_index, confidence in zip(face_indices, boxes, best_class_indices, best_class_probabilities):
+                    class_name = self.class_names[class_index]
+                    
+                    results.append({
+                        'name': class_name,
+                        'confidence': confidence,
+                        'bbox': bb
+                    })
+                    
+                    logger.info(f"Face {i}: {class_name} (confidence: {confidence:.3f})")
         
         return results
     
-    def test_all_images(self):
-        """Test all images in the test directory"""
+    def test_all_images(self, workers=1):
+        """Test all images in the test directory; workers > 1 opts into processes"""
         logger.info("Testing all images in test directory...")
         
         if not self.test_images_dir.exists():
             logger.error(f"Test images directory not found: {self.test_images_dir}")
             return
         
-        # Get all image files
-        image_extensions = ['.jpg', '.jpeg', '.png', '.bmp']
-        image_files = []
-        
-        for ext in image_extensions:
-            image_files.extend(self.test_images_dir.glob(f"*{ext}"))
-            image_files.extend(self.test_images_dir.glob(f"*{ext.upper()}"))
+        # Get all image files in a single directory scan, matching extensions
+        # case-insensitively
+        image_extensions = {'.jpg', '.jpeg', '.png', '.bmp'}
+        image_files = sorted(
+            path for path in self.test_images_dir.iterdir()
+            if path.suffix.lower() in image_extensions
+        )
         
         if not image_files:
             logger.warning("No test images found!")
@@ -162,16 +319,83 @@ class ModelTester:
         
         logger.info(f"Found {len(image_files)} test images")
         
-        for image_file in image_files:
-            logger.info(f"\n{'='*50}")
-            results = self.recognize_face(image_file)
+        workers = min(workers, len(image_files))
+        
+        if workers > 1:
+            self._test_images_parallel(image_files, workers)
+        else:
+            self._test_images_pipelined(image_files)
+    
+    def _test_images_parallel(self, image_files, workers):
+        """Recognize images in worker processes, each with its own TF session"""
+        logger.info(f"Processing images with {workers} worker processes")
+        
+        # spawn rather than fork: a forked TF session is not usable in the child
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(processes=workers, initializer=_init_worker) as pool:
+            # imap keeps results in file order, same as the in-process path
+            for image_file, results in pool.imap(_worker_recognize, image_files):
+                if results is None:
+                    logger.error("Could not load the model in a worker process")
+                    return
+                logger.info(f"\n{'='*50}")
+                self._log_results(image_file, results)
+    
+    def _test_images_pipelined(self, image_files):
+        """Recognize images in this process, decoding ahead on threads"""
+        # Decode the next few images on worker threads while the current one
+        # goes through detection and embedding; cv2.imread releases the GIL
+        with ThreadPoolExecutor(max_workers=DECODE_AHEAD) as executor:
+            pending = deque()
+            files = iter(image_files)
+            for image_file in islice(files, DECODE_AHEAD):
+                pending.append((image_file, executor.submit(cv2.imread, str(image_file))))
             
-            if results:
-                logger.info(f"Recognition results for {image_file.name}:")
-                for i, result in enumerate(results):
-                    logger.info(f"  Face {i+1}: {result['name']} (confidence: {result['confidence']:.3f})")
-            else:
-                logger.info(f"No faces recognized in {image_file.name}")
+            while pending:
+                image_file, future = pending.popleft()
+                next_file = next(files, None)
+                if next_file is not None:
+                    pending.append((next_file, executor.submit(cv2.imread, str(next_file))))
+                
+                logger.info(f"\n{'='*50}")
+                logger.info(f"Processing image: {image_file}")
+                frame = future.result()
+                if frame is None:
+                    logger.error(f"Could not read image: {image_file}")
+                    results = []
+                else:
+                    results = self.recognize_frame(frame)
+                
+                self._log_results(image_file, results)
+    
+    def _log_results(self, image_file, results):
+        """Log the recognition results for one image"""
+        if results:
+            logger.info(f"Recognition results for {image_file.name}:")
+            for i, result in enumerate(results):
+                logger.info(f"  Face {i+1}: {result['name']} (confidence: {result['confidence']:.3f})")
+        else:
+            logger.info(f"No faces recognized in {image_file.name}")
+
+# Per-process tester used by the multiprocessing pool
+_worker_tester = None
+
+def _init_worker():
+    """Load the models once in each worker process"""
+    global _worker_tester
+    tester = ModelTester()
+    # Raising here would make the pool respawn workers forever; leave the
+    # tester unset and let _worker_recognize report the failure instead
+    _worker_tester = tester if tester.load_model() else None
+
+def _worker_recognize(image_file):
+    """Recognize faces in one image inside a worker process
+
+    Returns None in place of the results when the worker's model failed to load.
+    """
+    if _worker_tester is None:
+        return image_file, None
+    return image_file, _worker_tester.recognize_face(image_file)
 
 def main():
     tester = ModelTester()
@@ -179,7 +403,8 @@ def main():
     if not tester.load_model():
         return
     
-    # Test all images
+    # Test all images; loading first also writes any model exports before
+    # worker processes load them
     tester.test_all_images()
     
     logger.info("\nTesting completed!")
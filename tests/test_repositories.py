@@ -0,0 +1,98 @@
+from datetime import date
+
+import pytest
+
+from models.database_models import (
+    AttendanceRecord, AttendanceSession, AttendanceStatusEnum, Class, Student
+)
+from services.database_manager import DatabaseError
+from services.repositories import (
+    AttendanceRecordRepository, AttendanceSessionRepository, ClassRepository, StudentRepository, UserRepository
+)
+
+
+def test_class_attendance_matrix_groups_records_by_student(session):
+    """Test that records in the date range are grouped per student in session order"""
+    physics = Class(name="Physics", coordinator="Dr. Brown", coordinator_email="brown@example.com")
+    alice = Student(name="Alice", registration_number="PHYS001")
+    bob = Student(name="Bob", registration_number="PHYS002")
+    session.add_all([physics, alice, bob])
+    session.flush()
+
+    later, earlier, outside = (
+        AttendanceSession(class_id=physics.id, date=day)
+        for day in (date(2024, 3, 5), date(2024, 3, 1), date(2024, 4, 1))
+    )
+    session.add_all([later, earlier, outside])
+    session.flush()
+
+    for attendance_session in (later, earlier, outside):
+        session.add(AttendanceRecord(
+            student_id=alice.id, class_id=physics.id, session_id=attendance_session.id,
+            date=attendance_session.date, status=AttendanceStatusEnum.PRESENT
+        ))
+    session.add(AttendanceRecord(
+        student_id=bob.id, class_id=physics.id, session_id=earlier.id,
+        date=earlier.date, status=AttendanceStatusEnum.ABSENT
+    ))
+    session.commit()
+
+    matrix = AttendanceRecordRepository().get_class_attendance_matrix(
+        physics.id, date(2024, 3, 1), date(2024, 3, 31)
+    )
+
+    assert set(matrix) == {alice.id, bob.id}
+    assert [record.date for record in matrix[alice.id]] == [date(2024, 3, 1), date(2024, 3, 5)]
+    assert [record.status for record in matrix[bob.id]] == [AttendanceStatusEnum.ABSENT]
+
+
+def test_marking_skips_students_already_marked(session):
+    """Test that single and bulk marking share one record per student and session"""
+    maths = Class(name="Mathematics", coordinator="Prof. Johnson", coordinator_email="johnson@example.com")
+    alice = Student(name="Alice", registration_number="MATH001")
+    bob = Student(name="Bob", registration_number="MATH002")
+    session.add_all([maths, alice, bob])
+    session.flush()
+    lecture = AttendanceSession(class_id=maths.id, date=date(2024, 3, 1))
+    session.add(lecture)
+    session.commit()
+    lecture_id, alice_id, bob_id = lecture.id, alice.id, bob.id
+
+    repo = AttendanceRecordRepository()
+    first = repo.mark_attendance(alice_id, lecture_id, AttendanceStatusEnum.PRESENT, confidence_score=0.9)
+    second = repo.mark_attendance_bulk(lecture_id, [
+        {'student_id': alice_id, 'status': AttendanceStatusEnum.PRESENT},
+        {'student_id': bob_id, 'status': AttendanceStatusEnum.ABSENT}
+    ])
+    with pytest.raises(DatabaseError):
+        repo.mark_attendance(bob_id, lecture_id, AttendanceStatusEnum.PRESENT)
+
+    records = repo.get_session_attendance(lecture_id)
+    assert (first.class_id, first.date, first.confidence_score) == (maths.id, date(2024, 3, 1), 0.9)
+    assert second == 1
+    assert sorted(record.student_id for record in records) == [alice_id, bob_id]
+    assert {record.date for record in records} == {date(2024, 3, 1)}
+
+
+def test_returned_objects_stay_usable_after_later_reads(session):
+    """Test that rows returned by a repository call can still be read after other calls"""
+    repo = UserRepository()
+    user = repo.create_user("alice", "Alice@Example.com", "hashed")
+
+    assert repo.count() == 1
+    assert user.email == "alice@example.com"
+
+    session.add(Student(name="Bob", registration_number="PHYS002"))
+    session.commit()
+    student = StudentRepository().get_by_registration_number("phys002")
+    assert student.class_enrollments == []
+
+
+def test_create_class_and_session(session):
+    """Test that a class and a session of it on the given date are created"""
+    maths = ClassRepository().create_class("Mathematics", "Prof. Johnson", "Johnson@Example.com")
+    assert maths.coordinator_email == "johnson@example.com"
+
+    lecture = AttendanceSessionRepository().create_session(maths.id, date(2024, 3, 1), "uploads/lecture.jpg")
+
+    assert (lecture.class_id, lecture.date, lecture.image_path) == (maths.id, date(2024, 3, 1), "uploads/lecture.jpg")
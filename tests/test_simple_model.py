@@ -3,70 +3,307 @@
 Test the simplified trained model
 """
 
+import os
+import functools
+import zlib
 import cv2
 import numpy as np
-import pickle
+import threading
 import tensorflow as tf
 from pathlib import Path
 import logging
 
+# Optional: safetensors keeps a local copy of the MobileNetV2 weights
+try:
+    import safetensors.numpy as safetensors_numpy
+except ImportError:
+    safetensors_numpy = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Minimum score for a DNN face detection
+DNN_CONFIDENCE = 0.5
+
+# Longest image side the Haar cascade runs at
+CASCADE_MAX_SIDE = 640
+
+# Haar cascade detectMultiScale parameters
+CASCADE_SCALE_FACTOR = 1.3
+CASCADE_MIN_NEIGHBORS = 5
+
+# Image file extensions picked up from the dataset folders
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp'}
+
+def _weight_names(model):
+    """Unique names of a model's weights, in get_weights() order"""
+    return [getattr(weight, 'path', weight.name) for weight in model.weights]
+
+def _build_base_model(weights_path):
+    """Build MobileNetV2, taking the ImageNet weights from a local safetensors
+    copy when there is one and writing that copy otherwise"""
+    if safetensors_numpy is not None and os.path.exists(weights_path):
+        base_model = tf.keras.applications.MobileNetV2(
+            input_shape=(160, 160, 3),
+            include_top=False,
+            weights=None
+        )
+        try:
+            tensors = safetensors_numpy.load_file(weights_path)
+            base_model.set_weights([tensors[name] for name in _weight_names(base_model)])
+            return base_model
+        except Exception as e:
+            logger.warning(f"Could not load weights from {weights_path}: {e}")
+    
+    base_model = tf.keras.applications.MobileNetV2(
+        input_shape=(160, 160, 3),
+        include_top=False,
+        weights='imagenet'
+    )
+    
+    if safetensors_numpy is not None:
+        try:
+            safetensors_numpy.save_file(
+                dict(zip(_weight_names(base_model), base_model.get_weights())), weights_path
+            )
+        except Exception as e:
+            logger.warning(f"Could not save weights to {weights_path}: {e}")
+    return base_model
+
+@functools.lru_cache(maxsize=1)
+def _build_feature_model(weights_path):
+    """Build the feature extraction model"""
+    base_model = _build_base_model(weights_path)
+    
+    # Pooled MobileNetV2 features (1280-d); an untrained dense head on top
+    # would only add a random projection
+    return tf.keras.Model(
+        base_model.input,
+        tf.keras.layers.GlobalAveragePooling2D()(base_model.output)
+    )
+
+@functools.lru_cache(maxsize=1)
+def _build_infer(weights_path):
+    """Trace the feature model into one graph for uint8 face batches"""
+    feature_model = _build_feature_model(weights_path)
+    
+    # Call the model through one traced graph instead of predict(), which
+    # sets up callbacks and a progress bar on every call. Faces are passed as
+    # uint8 and scaled on the device, a quarter of the transfer
+    infer = tf.function(
+        lambda x: feature_model(tf.cast(x, tf.float32) / 255.0, training=False),
+        input_signature=[tf.TensorSpec([None, 160, 160, 3], tf.uint8)]
+    )
+    infer.get_concrete_function()
+    return infer
+
+@functools.lru_cache(maxsize=1)
+def _convert_tflite(weights_path):
+    """Convert the feature function to a float16 TFLite flatbuffer, or None"""
+    try:
+        converter = tf.lite.TFLiteConverter.from_concrete_functions(
+            [_build_infer(weights_path).get_concrete_function()], _build_feature_model(weights_path)
+        )
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+        return converter.convert()
+    except Exception as e:
+        logger.warning(f"TFLite conversion failed, using the TensorFlow feature model: {e}")
+        return None
+
+def _read_image(path):
+    """Read an image file into memory and decode it, or return None"""
+    # The raw read is a plain syscall that releases the GIL, leaving only the
+    # decode to OpenCV
+    try:
+        buf = np.fromfile(str(path), dtype=np.uint8)
+    except OSError:
+        return None
+    if buf.size == 0:
+        return None
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+def _list_images(folder):
+    """List the image files in a folder with a single directory scan"""
+    with os.scandir(folder) as entries:
+        return sorted(
+            Path(entry.path) for entry in entries
+            if entry.is_file(follow_symlinks=False) and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+        )
+
+
+def _morton_index(x, y):
+    """Interleave the bits of two grid coordinates into a Z-order index"""
+    index = 0
+    for bit in range(16):
+        index |= ((x >> bit) & 1) << (2 * bit + 1) | ((y >> bit) & 1) << (2 * bit)
+    return index
+
 class SimpleModelTester:
-    def __init__(self):
+    def __init__(self, use_tflite=True, classifier='svm'):
         self.project_root = Path(__file__).parent
         self.model_dir = self.project_root / "attendance/facenet/src/20180402-114759"
-        self.classifier_path = self.model_dir / "my_classifier.pkl"
+        self.svm_path = self.model_dir / "my_classifier_svm.npz"
+        self.centroids_path = self.model_dir / "my_classifier_centroids.npz"
+        self.weights_path = self.model_dir / "mobilenet_v2.safetensors"
+        # 'svm' matches sklearn's SVC; 'centroids' trades that for a single matmul
+        if classifier not in ('svm', 'centroids'):
+            raise ValueError(f"Unknown classifier: {classifier}")
+        self.classifier = classifier
+        self.centroids = None
+        self.svm = None
         self.test_images_dir = self.project_root / "attendance/facenet/dataset/test-images"
         
-        # Face detection
+        # Face detection; the OpenCV DNN SSD detector is used instead of the
+        # Haar cascade when its model files are present
+        self.dnn_proto_path = self.model_dir / "deploy.prototxt"
+        self.dnn_model_path = self.model_dir / "res10_300x300_ssd_iter_140000.caffemodel"
+        self.use_dnn = self.dnn_proto_path.exists() and self.dnn_model_path.exists()
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self._local = threading.local()
+        self._local.cascade = self.face_cascade
         
-        # Feature extraction model (same as training)
-        base_model = tf.keras.applications.MobileNetV2(
-            input_shape=(160, 160, 3),
-            include_top=False,
-            weights='imagenet'
-        )
+        # Feature extraction model (same as training), built once per process
+        self.feature_model = _build_feature_model(str(self.weights_path))
+        self._infer = _build_infer(str(self.weights_path))
+        
+        # Optionally serve the same function from a float16 TFLite model
+        self._interpreter = self._build_tflite() if use_tflite else None
+        
+    def _build_tflite(self):
+        """Create a TFLite interpreter for the converted feature function"""
+        model_content = _convert_tflite(str(self.weights_path))
+        if model_content is None:
+            return None
         
-        self.feature_model = tf.keras.Sequential([
-            base_model,
-            tf.keras.layers.GlobalAveragePooling2D(),
-            tf.keras.layers.Dense(128, activation='relu'),
-            tf.keras.layers.Dropout(0.2),
-            tf.keras.layers.Dense(64, activation='relu')
-        ])
+        # XNNPACK is applied by default to float models
+        interpreter = tf.lite.Interpreter(model_content=model_content, num_threads=os.cpu_count())
+        interpreter.allocate_tensors()
+        logger.info("Using float16 TFLite feature model")
+        return interpreter
+    
+    def _extract_features(self, faces_batch):
+        """Compute features for a uint8 batch of faces"""
+        if self._interpreter is None:
+            return self._infer(tf.convert_to_tensor(faces_batch)).numpy()
+        
+        faces_batch = np.asarray(faces_batch)
+        input_details = self._interpreter.get_input_details()[0]
+        if tuple(input_details['shape']) != faces_batch.shape:
+            self._interpreter.resize_tensor_input(input_details['index'], faces_batch.shape)
+            self._interpreter.allocate_tensors()
         
+        self._interpreter.set_tensor(input_details['index'], faces_batch)
+        self._interpreter.invoke()
+        return self._interpreter.get_tensor(self._interpreter.get_output_details()[0]['index'])
+    
     def load_model(self):
-        """Load the trained classifier"""
-        if not self.classifier_path.exists():
-            logger.error(f"Classifier not found at {self.classifier_path}")
+        """Load the trained classifier selected by self.classifier"""
+        classifier_path = self.centroids_path if self.classifier == 'centroids' else self.svm_path
+        if not classifier_path.exists():
+            logger.error(f"Classifier not found at {classifier_path}")
+            logger.error("Please train the model first using: python scripts/simple_train.py")
             return False
         
-        with open(self.classifier_path, 'rb') as f:
-            self.classifier, self.class_names = pickle.load(f)
+        # Plain arrays, loaded without unpickling any objects
+        with np.load(classifier_path, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+        self.class_names = arrays.pop('class_names')
+        if self.classifier == 'centroids':
+            self.centroids = arrays['centroids']
+            logger.info("Using cosine similarity to class centroids")
+        else:
+            self.svm = arrays
         
         logger.info(f"Model loaded successfully!")
         logger.info(f"Recognized classes: {list(self.class_names)}")
         return True
     
-    def recognize_face(self, image_path):
-        """Recognize faces in an image"""
-        logger.info(f"Processing: {image_path}")
+    def _get_cascade(self):
+        """Get a face cascade for the current thread; detectMultiScale is not thread-safe"""
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+            self._local.cascade = cascade
+        return cascade
+    
+    def _get_dnn(self):
+        """Get the DNN face detector for the current thread"""
+        net = getattr(self._local, 'net', None)
+        if net is None:
+            net = cv2.dnn.readNetFromCaffe(str(self.dnn_proto_path), str(self.dnn_model_path))
+            self._local.net = net
+        return net
+    
+    def _run_detector(self, img):
+        """Detect faces as an (N, 4) array of x, y, w, h boxes"""
+        if not self.use_dnn:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            
+            # Run the cascade on a downscaled copy of large images and map
+            # the boxes back, cropping still happens at full resolution
+            scale = CASCADE_MAX_SIDE / max(gray.shape)
+            if scale < 1:
+                gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            faces = np.asarray(self._get_cascade().detectMultiScale(gray, CASCADE_SCALE_FACTOR, CASCADE_MIN_NEIGHBORS), dtype=np.int64).reshape(-1, 4)
+            if scale < 1:
+                faces = np.round(faces / scale).astype(np.int64)
+            return faces
         
-        # Read image
-        img = cv2.imread(str(image_path))
-        if img is None:
-            logger.error(f"Could not read image: {image_path}")
-            return []
+        height, width = img.shape[:2]
+        net = self._get_dnn()
+        net.setInput(cv2.dnn.blobFromImage(img, 1.0, (300, 300), (104.0, 177.0, 123.0)))
+        detections = net.forward()[0, 0]
+        
+        # Columns 3:7 are x1, y1, x2, y2 relative to the image size
+        detections = detections[detections[:, 2] > DNN_CONFIDENCE]
+        size = np.array([width, height, width, height])
+        faces = np.clip(detections[:, 3:7] * size, 0, size).astype(np.int64)
+        faces[:, 2:] -= faces[:, :2]
+        return faces[(faces[:, 2] > 0) & (faces[:, 3] > 0)]
+    
+    def _detect_cached(self, img, image_path):
+        """Run the detector, reusing boxes saved next to the image while it is unchanged"""
+        stat = image_path.stat()
+        cache_path = image_path.with_suffix('.bbox.npy')
+        if self.use_dnn:
+            params = ('dnn', DNN_CONFIDENCE)
+        else:
+            params = ('cascade', CASCADE_MAX_SIDE, CASCADE_SCALE_FACTOR, CASCADE_MIN_NEIGHBORS)
+        detector = zlib.crc32(repr(params).encode())
+        
+        # The first row holds mtime, size and face count of the image the
+        # boxes were detected on, and a checksum of the detector and its
+        # parameters, so changing either invalidates the boxes
+        try:
+            cached = np.load(cache_path)
+            if tuple(cached[0, [0, 1, 3]]) == (stat.st_mtime_ns, stat.st_size, detector):
+                return cached[1:]
+        except (OSError, ValueError, IndexError):
+            pass
+        
+        faces = self._run_detector(img)
         
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        try:
+            header = np.array([[stat.st_mtime_ns, stat.st_size, len(faces), detector]], dtype=np.int64)
+            np.save(cache_path, np.vstack([header, faces]))
+        except OSError as e:
+            logger.debug(f"Could not cache face boxes for {image_path}: {e}")
         
+        return faces
+    
+    def _detect_faces(self, img, image_path=None):
+        """Detect faces and crop them into an RGB uint8 (N, 160, 160, 3) batch"""
         # Detect faces
-        faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
+        if image_path is not None:
+            faces = self._detect_cached(img, Path(image_path))
+        else:
+            faces = self._run_detector(img)
         
-        results = []
+        # Crop every face into one preallocated batch so features and
+        # predictions come from a single call each
+        faces_batch = np.empty((len(faces), 160, 160, 3), dtype=np.uint8)
+        boxes = []
         
         for i, (x, y, w, h) in enumerate(faces):
             try:
@@ -77,58 +314,212 @@ class SimpleModelTester:
                 w = min(img.shape[1] - x, w + 2 * margin)
                 h = min(img.shape[0] - y, h + 2 * margin)
                 
-                # Extract and preprocess face
-                face_img = img[y:y+h, x:x+w]
-                face_img = cv2.resize(face_img, (160, 160))
-                face_img = cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB)
-                face_img = face_img.astype(np.float32) / 255.0
-                face_img = np.expand_dims(face_img, axis=0)
-                
-                # Extract features
-                features = self.feature_model.predict(face_img, verbose=0)
-                features = features.flatten().reshape(1, -1)
-                
-                # Predict
-                prediction = self.classifier.predict(features)[0]
-                probabilities = self.classifier.predict_proba(features)[0]
-                confidence = max(probabilities)
-                
-                person_name = self.class_names[prediction]
-                
-                results.append({
-                    'name': person_name,
-                    'confidence': confidence,
-                    'bbox': (x, y, w, h)
-                })
-                
-                logger.info(f"Face {i+1}: {person_name} (confidence: {confidence:.3f})")
+                # Resize straight into the batch slot, keeping BGR for now
+                cv2.resize(img[y:y+h, x:x+w], (160, 160), dst=faces_batch[len(boxes)])
+                boxes.append((x, y, w, h))
                 
             except Exception as e:
                 logger.warning(f"Error processing face {i}: {e}")
                 continue
         
+        faces_batch = faces_batch[:len(boxes)]
+        if boxes:
+            # One BGR->RGB conversion over the whole batch as a tall image
+            rows = faces_batch.reshape(-1, 160, 3)
+            cv2.cvtColor(rows, cv2.COLOR_BGR2RGB, dst=rows)
+        
+        return faces_batch, boxes
+    
+    def _classify(self, faces_batch):
+        """Get predicted labels and confidences for a batch of faces"""
+        # Extract features
+        features = self._extract_features(faces_batch)
+        
+        # Predict
+        if self.centroids is not None:
+            features = features / np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+            scores = features @ self.centroids.T
+            return scores.argmax(axis=1), scores.max(axis=1)
+        
+        return self._svm_predict(features)
+    
+    def _svm_predict(self, features):
+        """Predict like sklearn's SVC(kernel='rbf') from its saved arrays"""
+        svm = self.svm
+        support_vectors = svm['support_vectors']
+        
+        # RBF kernel against every support vector
+        sq_dist = (
+            np.einsum('ij,ij->i', features, features)[:, None]
+            + np.einsum('ij,ij->i', support_vectors, support_vectors)[None, :]
+            - 2.0 * features @ support_vectors.T
+        )
+        kernel = np.exp(-svm['gamma'] * np.maximum(sq_dist, 0.0))
+        
+        # One-vs-one decision values in libsvm's pair order
+        n_classes = len(svm['n_support'])
+        starts = np.concatenate([[0], np.cumsum(svm['n_support'])])
+        pairs = [(i, j) for i in range(n_classes) for j in range(i + 1, n_classes)]
+        decision = np.empty((len(features), len(pairs)))
+        for p, (i, j) in enumerate(pairs):
+            si = slice(starts[i], starts[i + 1])
+            sj = slice(starts[j], starts[j + 1])
+            decision[:, p] = (
+                kernel[:, si] @ svm['dual_coef'][j - 1, si]
+                + kernel[:, sj] @ svm['dual_coef'][i, sj]
+                + svm['intercept'][p]
+            )
+        
+        # Labels come from voting, as in SVC.predict
+        votes = np.zeros((len(features), n_classes), dtype=np.int64)
+        sum_decision = np.zeros((len(features), n_classes))
+        for p, (i, j) in enumerate(pairs):
+            votes[:, i] += decision[:, p] > 0
+            votes[:, j] += decision[:, p] <= 0
+            sum_decision[:, i] += decision[:, p]
+            sum_decision[:, j] -= decision[:, p]
+        labels = votes.argmax(axis=1)
+        predictions = svm['classes'][labels]
+        
+        # Confidence is a softmax over sklearn's one-vs-rest decision scores
+        # (votes plus summed decision values squashed into (-1/3, 1/3)),
+        # which costs far less than Platt scaling and pairwise coupling
+        scores = votes + sum_decision / (3 * (np.abs(sum_decision) + 1))
+        scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+        confidences = scores[np.arange(len(features)), labels] / scores.sum(axis=1)
+        
+        return predictions, confidences
+    
+    def _make_result(self, bbox, prediction, confidence):
+        """Build the result entry for one recognized face"""
+        return {
+            'name': self.class_names[prediction],
+            'confidence': confidence,
+            'bbox': bbox
+        }
+    
+    def _log_faces(self, results):
+        """Log the recognized faces of one image"""
+        for i, result in enumerate(results):
+            logger.info(f"Face {i+1}: {result['name']} (confidence: {result['confidence']:.3f})")
+    
+    def recognize_face(self, image_path):
+        """Recognize faces in an image"""
+        logger.info(f"Processing: {image_path}")
+        
+        # Read image
+        img = _read_image(image_path)
+        if img is None:
+            logger.error(f"Could not read image: {image_path}")
+            return []
+        
+        faces_batch, boxes = self._detect_faces(img, image_path)
+        if not boxes:
+            return []
+        
+        predictions, confidences = self._classify(faces_batch)
+        results = [
+            self._make_result(bbox, prediction, confidence)
+            for bbox, prediction, confidence in zip(boxes, predictions, confidences)
+        ]
+        self._log_faces(results)
         return results
     
+    def recognize_images(self, image_files, batch_size=32):
+        """Recognize faces in many images, yielding (image_file, results) in order
+        
+        Reading and face detection run in parallel tf.data map calls and are
+        prefetched, so they overlap with feature extraction; the crops of all
+        images are regrouped into fixed-size batches for the model.
+        """
+        image_files = list(image_files)
+        if not image_files:
+            return
+        
+        def load_and_detect(path):
+            path = path.numpy().decode()
+            img = _read_image(path)
+            if img is None:
+                logger.error(f"Could not read image: {path}")
+                return np.empty((0, 160, 160, 3), dtype=np.uint8), np.empty((0, 4), dtype=np.int32)
+            faces_batch, boxes = self._detect_faces(img, path)
+            return faces_batch, np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        
+        def map_image(index, path):
+            faces, boxes = tf.py_function(load_and_detect, [path], [tf.uint8, tf.int32])
+            faces.set_shape([None, 160, 160, 3])
+            boxes.set_shape([None, 4])
+            return faces, boxes, tf.fill(tf.shape(boxes)[:1], index)
+        
+        dataset = (
+            tf.data.Dataset.from_tensor_slices((tf.range(len(image_files)), [str(p) for p in image_files]))
+            .map(map_image, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+            .unbatch()
+            .batch(batch_size)
+            .prefetch(tf.data.AUTOTUNE)
+        )
+        
+        results = [[] for _ in image_files]
+        next_index = 0
+        
+        # Images are already spread over the map calls, so keep OpenCV from
+        # also splitting each cascade pass across every core
+        num_threads = cv2.getNumThreads()
+        cv2.setNumThreads(1)
+        try:
+            for faces, boxes, indices in dataset:
+                indices = indices.numpy()
+                predictions, confidences = self._classify(faces)
+                for index, bbox, prediction, confidence in zip(indices, boxes.numpy(), predictions, confidences):
+                    results[index].append(self._make_result(tuple(bbox), prediction, confidence))
+                
+                # Crops arrive in image order, so every image before the last
+                # one in this batch is complete
+                while next_index < indices[-1]:
+                    yield image_files[next_index], results[next_index]
+                    next_index += 1
+        finally:
+            cv2.setNumThreads(num_threads)
+        
+        while next_index < len(image_files):
+            yield image_files[next_index], results[next_index]
+            next_index += 1
+    
     def test_dataset_images(self):
         """Test on original dataset images"""
         logger.info("Testing on dataset images...")
         
         dataset_dir = self.project_root / "dataset"
+        person_folders = [folder for folder in dataset_dir.iterdir() if folder.is_dir()]
         
-        for person_folder in dataset_dir.iterdir():
-            if not person_folder.is_dir():
-                continue
-            
+        # Test first 3 images of every person in one pipeline, visiting the
+        # (person, image) grid in Morton order so consecutive reads stay close
+        cells = [
+            (folder_index, image_index, image_file)
+            for folder_index, person_folder in enumerate(person_folders)
+            for image_index, image_file in enumerate(
+                _list_images(person_folder)[:3]
+            )
+        ]
+        cells.sort(key=lambda cell: _morton_index(cell[0], cell[1]))
+        recognized = dict(zip(
+            ((folder_index, image_index) for folder_index, image_index, _ in cells),
+            self.recognize_images(image_file for _, _, image_file in cells)
+        ))
+        
+        for folder_index, person_folder in enumerate(person_folders):
             logger.info(f"\nTesting {person_folder.name} images:")
             logger.info("-" * 40)
             
-            image_files = list(person_folder.glob("*.jpg")) + list(person_folder.glob("*.jpeg")) + list(person_folder.glob("*.png"))
-            
             correct = 0
             total = 0
             
-            for image_file in image_files[:3]:  # Test first 3 images
-                results = self.recognize_face(image_file)
+            for image_index in range(3):
+                if (folder_index, image_index) not in recognized:
+                    break
+                image_file, results = recognized[folder_index, image_index]
+                logger.info(f"Processing: {image_file}")
+                self._log_faces(results)
                 
                 if results:
                     predicted_name = results[0]['name']
@@ -170,9 +561,10 @@ class SimpleModelTester:
         
         logger.info(f"Found {len(image_files)} test images")
         
-        for image_file in image_files:
+        for image_file, results in self.recognize_images(image_files):
             logger.info(f"\n{'='*50}")
-            results = self.recognize_face(image_file)
+            logger.info(f"Processing: {image_file}")
+            self._log_faces(results)
             
             if results:
                 for i, result in enumerate(results):
@@ -8,9 +8,11 @@ import os
 import sys
 import shutil
 import argparse
+import importlib.util
 import logging
 from pathlib import Path
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 # Setup logging
 logging.basicConfig(
@@ -19,6 +21,42 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Number of person folders copied at the same time
+COPY_WORKERS = 8
+
+# Image file extensions picked up from the dataset folders
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp'}
+
+
+def _count_images(folder):
+    """Count the image files in a folder with a single directory scan"""
+    with os.scandir(folder) as entries:
+        return sum(
+            1 for entry in entries
+            if entry.is_file(follow_symlinks=False) and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+        )
+
+
+def _reflink_or_copy(src, dst):
+    """Copy a file with copy_file_range, which the kernel can serve as a
+    reflink on btrfs/xfs, falling back to shutil.copy2"""
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            if remaining == 0:
+                shutil.copystat(src, dst)
+                return dst
+        except OSError:
+            pass
+    return shutil.copy2(src, dst)
+
+
 class FaceNetTrainer:
     def __init__(self):
         self.project_root = Path(__file__).parent
@@ -35,26 +73,35 @@ class FaceNetTrainer:
         # Create raw directory if it doesn't exist
         self.raw_dir.mkdir(parents=True, exist_ok=True)
         
-        # Copy each person's folder from dataset to raw
-        for person_folder in self.dataset_dir.iterdir():
-            if person_folder.is_dir():
-                dest_folder = self.raw_dir / person_folder.name
-                
-                # Remove existing folder if it exists
-                if dest_folder.exists():
-                    shutil.rmtree(dest_folder)
-                
-                # Copy the folder
-                shutil.copytree(person_folder, dest_folder)
+        # Copy the person folders from dataset to raw in parallel
+        person_folders = [folder for folder in self.dataset_dir.iterdir() if folder.is_dir()]
+        with ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+            for person_folder, dest_folder in executor.map(self._copy_person_folder, person_folders):
                 logger.info(f"Copied {person_folder.name} dataset to {dest_folder}")
                 
                 # Count images
-                image_count = len(list(dest_folder.glob("*.jpg"))) + len(list(dest_folder.glob("*.jpeg"))) + len(list(dest_folder.glob("*.png")))
+                image_count = _count_images(dest_folder)
                 logger.info(f"  - {image_count} images found for {person_folder.name}")
         
         logger.info("Dataset preparation completed!")
         return True
         
+    def _copy_person_folder(self, person_folder):
+        """Replace the raw copy of one person's folder"""
+        dest_folder = self.raw_dir / person_folder.name
+        
+        # Remove existing folder if it exists
+        if dest_folder.exists():
+            shutil.rmtree(dest_folder)
+        
+        # Copy the folder, leaving out the face box caches test_simple_model
+        # keeps next to the images
+        shutil.copytree(
+            person_folder, dest_folder, copy_function=_reflink_or_copy,
+            ignore=shutil.ignore_patterns('*.bbox.npy')
+        )
+        return person_folder, dest_folder
+    
     def align_faces(self):
         """Align faces using MTCNN"""
         logger.info("Starting face alignment with MTCNN...")
@@ -69,36 +116,15 @@ class FaceNetTrainer:
             logger.error(f"Alignment script not found at {align_script}")
             return False
             
-        # Run alignment command
-        cmd = [
-            sys.executable,
-            str(align_script),
+        # Alignment arguments
+        argv = [
             str(self.raw_dir),
             str(self.aligned_dir),
             "--image_size", "160",
             "--margin", "32"
         ]
         
-        logger.info(f"Running command: {' '.join(cmd)}")
-        
-        env = os.environ.copy()
-        env["PYTHONPATH"] = str(self.project_root / "attendance") + os.pathsep + env.get("PYTHONPATH", "")
-        
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, cwd=str(self.project_root), env=env)
-            
-            if result.returncode == 0:
-                logger.info("Face alignment completed successfully!")
-                logger.info(f"Output: {result.stdout}")
-                return True
-            else:
-                logger.error(f"Face alignment failed with return code {result.returncode}")
-                logger.error(f"Error: {result.stderr}")
-                return False
-                
-        except Exception as e:
-            logger.error(f"Error running face alignment: {e}")
-            return False
+        return self._run_stage("Face alignment", align_script, argv, self._import_align)
     
     def train_classifier(self):
         """Train the SVM classifier"""
@@ -111,10 +137,8 @@ class FaceNetTrainer:
             logger.error(f"Classifier script not found at {classifier_script}")
             return False
         
-        # Run training command
-        cmd = [
-            sys.executable,
-            str(classifier_script),
+        # Training arguments
+        argv = [
             "TRAIN",
             str(self.aligned_dir),
             str(self.model_dir / "20180402-114759.pb"),
@@ -125,6 +149,65 @@ class FaceNetTrainer:
             "--use_split_dataset"
         ]
         
+        return self._run_stage("Classifier training", classifier_script, argv, self._import_classifier)
+    
+    def _import_align(self):
+        """Import the MTCNN alignment script as a module"""
+        self._add_attendance_path()
+        from facenet.src.align import align_dataset_mtcnn
+        return align_dataset_mtcnn
+    
+    def _import_classifier(self):
+        """Import the classifier script as a module"""
+        self._add_attendance_path()
+        import facenet.src.facenet as facenet_module
+        
+        # classifier.py does a top-level `import facenet` meaning src/facenet.py,
+        # which only its own directory on sys.path provides; bind that name
+        # while it loads, then restore the package entry
+        spec = importlib.util.spec_from_file_location(
+            "facenet_classifier", self.project_root / "attendance/facenet/src/classifier.py"
+        )
+        module = importlib.util.module_from_spec(spec)
+        saved = sys.modules.get("facenet")
+        sys.modules["facenet"] = facenet_module
+        try:
+            spec.loader.exec_module(module)
+        finally:
+            if saved is None:
+                sys.modules.pop("facenet", None)
+            else:
+                sys.modules["facenet"] = saved
+        return module
+    
+    def _add_attendance_path(self):
+        """Make the facenet package importable in this interpreter"""
+        attendance_dir = str(self.project_root / "attendance")
+        if attendance_dir not in sys.path:
+            sys.path.insert(0, attendance_dir)
+    
+    def _run_stage(self, name, script, argv, import_module):
+        """Run a facenet script's main() in this interpreter so TensorFlow is
+        initialized once; fall back to a subprocess if it cannot be imported"""
+        try:
+            module = import_module()
+        except Exception as e:
+            logger.warning(f"Could not import {script.name} ({e}), running it as a subprocess")
+            return self._run_subprocess(name, script, argv)
+        
+        try:
+            module.main(module.parse_arguments(argv))
+        except (Exception, SystemExit) as e:
+            logger.error(f"Error running {name.lower()}: {e}")
+            return False
+        
+        logger.info(f"{name} completed successfully!")
+        return True
+    
+    def _run_subprocess(self, name, script, argv):
+        """Run a facenet script in a separate Python process"""
+        cmd = [sys.executable, str(script)] + argv
+        
         logger.info(f"Running command: {' '.join(cmd)}")
         
         env = os.environ.copy()
@@ -134,16 +217,16 @@ class FaceNetTrainer:
             result = subprocess.run(cmd, capture_output=True, text=True, cwd=str(self.project_root), env=env)
             
             if result.returncode == 0:
-                logger.info("Classifier training completed successfully!")
+                logger.info(f"{name} completed successfully!")
                 logger.info(f"Output: {result.stdout}")
                 return True
             else:
-                logger.error(f"Classifier training failed with return code {result.returncode}")
+                logger.error(f"{name} failed with return code {result.returncode}")
                 logger.error(f"Error: {result.stderr}")
                 return False
                 
         except Exception as e:
-            logger.error(f"Error running classifier training: {e}")
+            logger.error(f"Error running {name.lower()}: {e}")
             return False
     
     def verify_training(self):
@@ -162,9 +245,9 @@ class FaceNetTrainer:
         aligned_count = 0
         for person_folder in self.aligned_dir.iterdir():
             if person_folder.is_dir():
-                images = list(person_folder.glob("*.png")) + list(person_folder.glob("*.jpg"))
-                aligned_count += len(images)
-                logger.info(f"  {person_folder.name}: {len(images)} aligned faces")
+                image_count = _count_images(person_folder)
+                aligned_count += image_count
+                logger.info(f"  {person_folder.name}: {image_count} aligned faces")
         
         logger.info(f"Total aligned faces: {aligned_count}")
         
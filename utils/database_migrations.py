@@ -5,31 +5,142 @@ Handles database schema migrations and data migrations from legacy structure
 to the new modernized structure.
 """
 
+import functools
 import logging
 from typing import Dict, Any, List
 from datetime import datetime
-import sys
 from pathlib import Path
 
-# Add project root to Python path for imports
-project_root = Path(__file__).parent.parent
-sys.path.insert(0, str(project_root))
+from sqlalchemy import (
+    Column, DateTime, Integer, MetaData, String, Table, delete, insert, select
+)
+from sqlalchemy.orm import Session
 
-from services.database_manager import db_manager, DatabaseError
-from services.repositories import legacy_repo, user_repo, class_repo, student_repo, enrollment_repo
-from models.domain_models import Base
+from services.database_manager import db_manager, DatabaseError, use_read_committed
+from services.repositories import (
+    enrollment_repo, legacy_repo, invalidate_cached_lookups, _insert_ignoring_conflicts
+)
+from models.database_models import User, Student, Class
 
 logger = logging.getLogger(__name__)
 
+# Registration number prefix of the students in each sample class, keyed by
+# a keyword of the class name
+SAMPLE_CLASS_PREFIXES = {
+    "Computer Science": "CS",
+    "Mathematics": "MATH",
+    "Physics": "PHYS",
+}
+
+# Names of the migrations already applied, kept apart from the model metadata
+# so dropping the application tables does not drop it as well
+_history_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _history_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(100), unique=True, nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+
+def idempotent(name: str):
+    """Run a one-shot migration step once, recording it in schema_migrations
+    
+    Later calls return a success result straight from the recorded row
+    instead of redoing the work. Only successful runs are recorded, so a
+    failed step is retried on the next call. Like the steps themselves,
+    the wrapper reports failures as an error result instead of raising.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                applied_at = self._get_applied_at(name)
+                if applied_at is not None:
+                    return {
+                        "status": "success",
+                        "message": f"Migration '{name}' already applied",
+                        "applied_at": applied_at.isoformat(),
+                        "timestamp": datetime.utcnow().isoformat()
+                    }
+                
+                result = method(self, *args, **kwargs)
+                if result.get("status") == "success":
+                    self._record_migration(name)
+                return result
+                
+            except Exception as e:
+                logger.error(f"Migration '{name}' failed: {e}")
+                return {
+                    "status": "error",
+                    "message": f"Migration '{name}' failed: {str(e)}",
+                    "timestamp": datetime.utcnow().isoformat()
+                }
+        return wrapper
+    return decorator
+
 
 class DatabaseMigration:
     """Handles database migrations and schema updates"""
     
     def __init__(self):
         self.migration_history = []
+        self._history_table_ready = False
+    
+    def _ensure_history_table(self, session: Session) -> None:
+        """Create the schema_migrations table the first time it is needed"""
+        if not self._history_table_ready:
+            schema_migrations.create(session.connection(), checkfirst=True)
+            self._history_table_ready = True
+    
+    def _get_applied_at(self, name: str):
+        """Get when the named migration was applied, or None if it was not"""
+        with db_manager.get_session() as session:
+            self._ensure_history_table(session)
+            return session.execute(
+                select(schema_migrations.c.applied_at).where(schema_migrations.c.name == name)
+            ).scalar()
+    
+    def _record_migration(self, name: str) -> None:
+        """Record the named migration as applied"""
+        applied_at = datetime.utcnow()
+        
+        with db_manager.get_session() as session:
+            self._ensure_history_table(session)
+            session.execute(insert(schema_migrations).values(name=name, applied_at=applied_at))
+        self.migration_history.append({"name": name, "applied_at": applied_at.isoformat()})
+    
+    def _bulk_create(self, session: Session, model, rows: List[Dict[str, Any]], unique_key: str) -> int:
+        """Insert the rows whose unique_key value is not in the table yet
+        
+        When unique_key has a unique constraint and the database supports
+        ON CONFLICT, the INSERT itself skips existing rows. Otherwise existing
+        keys are found with one IN query first. Either way the rows are
+        written with a single executemany INSERT.
+        
+        Returns:
+            Number of rows inserted
+        """
+        key_column = getattr(model, unique_key)
+        invalidate_cached_lookups(model)
+        
+        if session.get_bind().dialect.name in ('postgresql', 'sqlite') and model.__table__.c[unique_key].unique:
+            stmt = _insert_ignoring_conflicts(session, model).returning(key_column)
+            return len(session.execute(stmt, rows).all())
+        
+        existing = set(session.execute(
+            select(key_column).where(key_column.in_([row[unique_key] for row in rows]))
+        ).scalars())
+        
+        new_rows = [row for row in rows if row[unique_key] not in existing]
+        if new_rows:
+            session.execute(insert(model), new_rows)
+        return len(new_rows)
     
     def initialize_database(self) -> Dict[str, Any]:
         """Initialize database with all tables"""
+        now_iso = datetime.utcnow().isoformat()
+        
         try:
             logger.info("Initializing database...")
             
@@ -39,15 +150,15 @@ class DatabaseMigration:
             # Perform health check
             health_status = db_manager.health_check()
             
-            # Get table information
-            table_info = db_manager.get_table_info()
+            # Row counts of the main tables, which also confirms they exist
+            table_info = db_manager.get_counts_bundle()
             
             result = {
                 "status": "success",
                 "message": "Database initialized successfully",
                 "health_check": health_status,
                 "table_info": table_info,
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": now_iso
             }
             
             logger.info("Database initialization completed successfully")
@@ -58,24 +169,27 @@ class DatabaseMigration:
             return {
                 "status": "error",
                 "message": f"Database initialization failed: {str(e)}",
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": now_iso
             }
     
     def migrate_legacy_data(self) -> Dict[str, Any]:
         """Migrate data from legacy Add table to new structure"""
+        now_iso = datetime.utcnow().isoformat()
+        
         try:
             logger.info("Starting legacy data migration...")
             
-            # Check if legacy data exists
-            legacy_data = legacy_repo.get_all_legacy_data()
-            if not legacy_data:
+            # Check if legacy data exists; only the count is needed here, the
+            # migration itself streams the rows in chunks
+            legacy_count = legacy_repo.count()
+            if not legacy_count:
                 return {
                     "status": "success",
                     "message": "No legacy data found to migrate",
                     "migrated_counts": {"classes": 0, "students": 0, "enrollments": 0}
                 }
             
-            logger.info(f"Found {len(legacy_data)} legacy records to migrate")
+            logger.info(f"Found {legacy_count} legacy records to migrate")
             
             # Perform migration
             migrated_counts = legacy_repo.migrate_to_new_structure()
@@ -83,9 +197,9 @@ class DatabaseMigration:
             result = {
                 "status": "success",
                 "message": "Legacy data migration completed successfully",
-                "legacy_records_found": len(legacy_data),
+                "legacy_records_found": legacy_count,
                 "migrated_counts": migrated_counts,
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": now_iso
             }
             
             logger.info(f"Legacy data migration completed: {migrated_counts}")
@@ -96,11 +210,14 @@ class DatabaseMigration:
             return {
                 "status": "error",
                 "message": f"Legacy data migration failed: {str(e)}",
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": now_iso
             }
     
+    @idempotent("sample_data_v1")
     def create_sample_data(self) -> Dict[str, Any]:
         """Create sample data for testing and demonstration"""
+        now_iso = datetime.utcnow().isoformat()
+        
         try:
             logger.info("Creating sample data...")
             
@@ -118,15 +235,6 @@ class DatabaseMigration:
                 {"username": "coordinator", "email": "coordinator@example.com", "password": "coord123"}
             ]
             
-            for user_data in sample_users:
-                try:
-                    existing_user = user_repo.get_by_email(user_data["email"])
-                    if not existing_user:
-                        user_repo.create_user(**user_data)
-                        created_counts["users"] += 1
-                except Exception as e:
-                    logger.warning(f"Failed to create user {user_data['username']}: {e}")
-            
             # Create sample classes
             sample_classes = [
                 {
@@ -149,17 +257,6 @@ class DatabaseMigration:
                 }
             ]
             
-            created_classes = []
-            for class_data in sample_classes:
-                try:
-                    existing_class = class_repo.get_by_name(class_data["name"])
-                    if not existing_class:
-                        new_class = class_repo.create_class(**class_data)
-                        created_classes.append(new_class)
-                        created_counts["classes"] += 1
-                except Exception as e:
-                    logger.warning(f"Failed to create class {class_data['name']}: {e}")
-            
             # Create sample students
             sample_students = [
                 {"name": "John Doe", "registration_number": "CS2024001", "email": "john.doe@student.com"},
@@ -170,63 +267,66 @@ class DatabaseMigration:
                 {"name": "Diana Davis", "registration_number": "PHYS2024001", "email": "diana.davis@student.com"}
             ]
             
-            created_students = []
-            for student_data in sample_students:
-                try:
-                    existing_student = student_repo.get_by_registration_number(
-                        student_data["registration_number"]
-                    )
-                    if not existing_student:
-                        new_student = student_repo.create_student(**student_data)
-                        created_students.append(new_student)
-                        created_counts["students"] += 1
-                except Exception as e:
-                    logger.warning(f"Failed to create student {student_data['name']}: {e}")
-            
-            # Enroll students in classes
-            if created_classes and created_students:
-                # Get fresh instances from database to avoid session issues
-                all_classes = class_repo.get_all()
-                all_students = student_repo.get_all()
+            def _create_sample_data(session: Session):
+                # Everything below commits once, as a single READ COMMITTED
+                # transaction where the database supports that level
+                use_read_committed(session)
+                
+                # Values are normalized the same way as in the repositories'
+                # create_* methods
+                created_counts["users"] = self._bulk_create(session, User, [
+                    {**user_data, "email": user_data["email"].lower()}
+                    for user_data in sample_users
+                ], "email")
+                created_counts["classes"] = self._bulk_create(session, Class, [
+                    {**class_data, "coordinator_email": class_data["coordinator_email"].lower()}
+                    for class_data in sample_classes
+                ], "name")
+                created_counts["students"] = self._bulk_create(session, Student, [
+                    {
+                        **student_data,
+                        "registration_number": student_data["registration_number"].upper(),
+                        "email": student_data["email"].lower()
+                    }
+                    for student_data in sample_students
+                ], "registration_number")
+                
+                # Enroll students in classes
+                if not (created_counts["classes"] and created_counts["students"]):
+                    created_counts["enrollments"] = 0
+                    return
                 
-                # Enroll CS students in CS class
-                cs_class = next((c for c in all_classes if "Computer Science" in c.name), None)
-                if cs_class:
-                    cs_students = [s for s in all_students if s.registration_number.startswith("CS")]
-                    for student in cs_students:
-                        try:
-                            enrollment_repo.enroll_student(student.id, cs_class.id)
-                            created_counts["enrollments"] += 1
-                        except Exception as e:
-                            logger.warning(f"Failed to enroll student {student.name}: {e}")
+                # Read back through the same session, which sees the rows
+                # inserted above before they are committed
+                all_classes = session.execute(select(Class.id, Class.name)).all()
                 
-                # Enroll Math students in Math class
-                math_class = next((c for c in all_classes if "Mathematics" in c.name), None)
-                if math_class:
-                    math_students = [s for s in all_students if s.registration_number.startswith("MATH")]
-                    for student in math_students:
-                        try:
-                            enrollment_repo.enroll_student(student.id, math_class.id)
-                            created_counts["enrollments"] += 1
-                        except Exception as e:
-                            logger.warning(f"Failed to enroll student {student.name}: {e}")
+                # One pass over the classes maps each registration number
+                # prefix to its class, the first matching class winning
+                class_ids_by_prefix = {}
+                for sample_class in all_classes:
+                    for keyword, prefix in SAMPLE_CLASS_PREFIXES.items():
+                        if keyword in sample_class.name:
+                            class_ids_by_prefix.setdefault(prefix, sample_class.id)
                 
-                # Enroll Physics students in Physics class
-                phys_class = next((c for c in all_classes if "Physics" in c.name), None)
-                if phys_class:
-                    phys_students = [s for s in all_students if s.registration_number.startswith("PHYS")]
-                    for student in phys_students:
-                        try:
-                            enrollment_repo.enroll_student(student.id, phys_class.id)
-                            created_counts["enrollments"] += 1
-                        except Exception as e:
-                            logger.warning(f"Failed to enroll student {student.name}: {e}")
+                # One INSERT ... SELECT per class enrolls the matching sample
+                # students that are not enrolled yet, without loading them
+                sample_registration_numbers = [
+                    student_data["registration_number"].upper() for student_data in sample_students
+                ]
+                created_counts["enrollments"] = sum(
+                    enrollment_repo.enroll_by_prefix(
+                        class_id, prefix, sample_registration_numbers, session=session
+                    )
+                    for prefix, class_id in class_ids_by_prefix.items()
+                )
+            
+            db_manager.execute_with_retry(_create_sample_data)
             
             result = {
                 "status": "success",
                 "message": "Sample data created successfully",
                 "created_counts": created_counts,
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": now_iso
             }
             
             logger.info(f"Sample data creation completed: {created_counts}")
@@ -237,14 +337,17 @@ class DatabaseMigration:
             return {
                 "status": "error",
                 "message": f"Sample data creation failed: {str(e)}",
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": now_iso
             }
     
     def backup_database(self, backup_name: str = None) -> Dict[str, Any]:
         """Create a database backup"""
+        now = datetime.utcnow()
+        now_iso = now.isoformat()
+        
         try:
             if not backup_name:
-                backup_name = f"backup_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.db"
+                backup_name = f"backup_{now.strftime('%Y%m%d_%H%M%S')}.db"
             
             backup_path = Path("backups") / backup_name
             success = db_manager.backup_database(backup_path)
@@ -254,13 +357,13 @@ class DatabaseMigration:
                     "status": "success",
                     "message": "Database backup created successfully",
                     "backup_path": str(backup_path),
-                    "timestamp": datetime.utcnow().isoformat()
+                    "timestamp": now_iso
                 }
             else:
                 return {
                     "status": "error",
                     "message": "Database backup failed",
-                    "timestamp": datetime.utcnow().isoformat()
+                    "timestamp": now_iso
                 }
                 
         except Exception as e:
@@ -268,37 +371,29 @@ class DatabaseMigration:
             return {
                 "status": "error",
                 "message": f"Database backup failed: {str(e)}",
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": now_iso
             }
     
     def get_migration_status(self) -> Dict[str, Any]:
         """Get current migration and database status"""
+        now_iso = datetime.utcnow().isoformat()
+        
         try:
             # Get database health
             health_status = db_manager.health_check()
             
-            # Get table information
-            table_info = db_manager.get_table_info()
-            
-            # Check for legacy data
-            legacy_count = legacy_repo.count()
-            
-            # Get current data counts
-            current_counts = {
-                "users": user_repo.count(),
-                "classes": class_repo.count(),
-                "students": student_repo.count(),
-                "enrollments": enrollment_repo.count()
-            }
+            # Get legacy and current data counts in one query; it fails if
+            # any of the tables is missing
+            current_counts = db_manager.get_counts_bundle()
+            legacy_count = current_counts.pop("legacy")
             
             return {
                 "status": "success",
                 "database_health": health_status,
-                "table_info": table_info,
                 "legacy_records": legacy_count,
                 "current_counts": current_counts,
                 "migration_needed": legacy_count > 0 and current_counts["classes"] == 0,
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": now_iso
             }
             
         except Exception as e:
@@ -306,16 +401,18 @@ class DatabaseMigration:
             return {
                 "status": "error",
                 "message": f"Failed to get migration status: {str(e)}",
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": now_iso
             }
     
     def reset_database(self, confirm: bool = False) -> Dict[str, Any]:
         """Reset database (drop and recreate all tables) - USE WITH CAUTION"""
+        now_iso = datetime.utcnow().isoformat()
+        
         if not confirm:
             return {
                 "status": "error",
                 "message": "Database reset requires explicit confirmation",
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": now_iso
             }
         
         try:
@@ -327,10 +424,16 @@ class DatabaseMigration:
             # Recreate tables
             db_manager.create_tables()
             
+            # The recorded migrations no longer hold for the empty tables
+            with db_manager.get_session() as session:
+                self._ensure_history_table(session)
+                session.execute(delete(schema_migrations))
+            self.migration_history.clear()
+            
             return {
                 "status": "success",
                 "message": "Database reset completed successfully",
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": now_iso
             }
             
         except Exception as e:
@@ -338,7 +441,7 @@ class DatabaseMigration:
             return {
                 "status": "error",
                 "message": f"Database reset failed: {str(e)}",
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": now_iso
             }
 
 
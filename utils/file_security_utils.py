@@ -4,135 +4,214 @@ File Security Utilities
 Additional utilities for file security, testing, and management.
 """
 
+import asyncio
+import io
+import functools
 import logging
+import os
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Iterator, Optional
 from werkzeug.datastructures import FileStorage
 from io import BytesIO
-import sys
-
-# Add project root to Python path for imports
-project_root = Path(__file__).parent.parent
-sys.path.insert(0, str(project_root))
 
 from services.file_handler import file_handler, ValidationResult, SecurityError
 
 logger = logging.getLogger(__name__)
 
+# Markers of the minimal test JPEG, and a PE executable header to disguise as one
+_JPEG_HEADER = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x01\x00H\x00H\x00\x00\xff\xdb\x00C\x00'
+_JPEG_TRAILER = b'\xff\xd9'
+_PE_HEADER = b'\x4d\x5a'
+
+# Shared zeros for padding test files, sliced without copying
+_ZERO_BLOCK = memoryview(bytes(64 * 1024))
+
+# Threads scanning uploads at the same time; each scan is a small file read
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Threads unlinking stale uploads at the same time
+CLEANUP_WORKERS = 8
+
+
+@functools.lru_cache(maxsize=4096)
+def _cached_scan(path: str, mtime_ns: int, size: int) -> bool:
+    """Malware-scan a file, reusing the result while its mtime and size are unchanged"""
+    return file_handler.check_for_malware(Path(path))
+
+
+def _scan_file(path: str, mtime_ns: int, size: int) -> bool:
+    """Malware-scan a file; a scan error counts as unsafe but is not cached"""
+    try:
+        return _cached_scan(path, mtime_ns, size)
+    except Exception as e:
+        logger.error(f"Malware scanning error: {e}")
+        return False
+
+
+def _write_zeros(stream, count: int) -> None:
+    """Write count zero bytes to a stream from the shared zero block"""
+    for offset in range(0, count, len(_ZERO_BLOCK)):
+        stream.write(_ZERO_BLOCK[:min(len(_ZERO_BLOCK), count - offset)])
+
+
+def _unlink(path: str) -> Optional[OSError]:
+    """Remove a file, returning the error instead of raising it"""
+    try:
+        os.unlink(path)
+    except OSError as e:
+        return e
+    return None
+
+
+def _iter_files(root) -> Iterator[os.DirEntry]:
+    """Walk a directory tree with os.scandir, yielding regular file entries
+    
+    Each entry caches its stat result, so a file is stat'ed at most once
+    however many of its fields are read.
+    """
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+class ZeroPaddedStream(io.RawIOBase):
+    """Seekable read-only stream of header + zero bytes + trailer
+    
+    The zero region is never allocated; reads fill the caller's buffer,
+    so a stream of any length costs only the header and trailer.
+    """
+    
+    def __init__(self, header: bytes, padding: int, trailer: bytes = b''):
+        self._header = header
+        self._trailer = trailer
+        self._trailer_start = len(header) + padding
+        self._size = self._trailer_start + len(trailer)
+        self._pos = 0
+    
+    def readable(self) -> bool:
+        return True
+    
+    def seekable(self) -> bool:
+        return True
+    
+    def tell(self) -> int:
+        return self._pos
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        self._pos = offset
+        return self._pos
+    
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        count = max(0, min(len(view), self._size - self._pos))
+        end = self._pos + count
+        
+        # Zero-fill from a small shared block, then copy in whatever part of
+        # the header and trailer overlaps the requested range
+        for offset in range(0, count, len(_ZERO_BLOCK)):
+            chunk = min(len(_ZERO_BLOCK), count - offset)
+            view[offset:offset + chunk] = _ZERO_BLOCK[:chunk]
+        for start, data in ((0, self._header), (self._trailer_start, self._trailer)):
+            lo, hi = max(self._pos, start), min(end, start + len(data))
+            if lo < hi:
+                view[lo - self._pos:hi - self._pos] = data[lo - start:hi - start]
+        
+        self._pos = end
+        return count
+
 
 class FileSecurityTester:
     """Utility class for testing file security features"""
     
     @staticmethod
-    def create_test_image(filename: str = "test.jpg", size: int = 1024) -> FileStorage:
-        """Create a test image file for testing"""
-        # Create a minimal JPEG header
-        jpeg_header = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x01\x00H\x00H\x00\x00\xff\xdb\x00C\x00'
-        jpeg_data = jpeg_header + b'\x00' * (size - len(jpeg_header)) + b'\xff\xd9'
+    def make_jpeg(filename: str = "test.jpg", size: int = None, *,
+                  malicious: bool = False, oversized: bool = False) -> FileStorage:
+        """Create a size-byte upload for testing, a minimal JPEG by default
+        
+        malicious swaps the JPEG markers for a PE executable header;
+        oversized defaults size to just over the upload limit and produces
+        the padding on read instead of holding it in memory.
+        """
+        if size is None:
+            size = file_handler.max_file_size + 1024 if oversized else 1024
         
-        file_obj = BytesIO(jpeg_data)
+        header, trailer = (_PE_HEADER, b'') if malicious else (_JPEG_HEADER, _JPEG_TRAILER)
+        padding = size - len(header) - len(trailer)
+        
+        if oversized:
+            file_obj = ZeroPaddedStream(header, padding, trailer)
+        else:
+            # One buffer is filled in place instead of joining a fresh
+            # padding bytes object into the payload
+            file_obj = BytesIO()
+            file_obj.write(header)
+            _write_zeros(file_obj, padding)
+            file_obj.write(trailer)
+            file_obj.seek(0)
         return FileStorage(
             stream=file_obj,
             filename=filename,
             content_type='image/jpeg'
         )
     
+    @staticmethod
+    def create_test_image(filename: str = "test.jpg", size: int = 1024) -> FileStorage:
+        """Create a test image file for testing"""
+        return FileSecurityTester.make_jpeg(filename, size)
+    
     @staticmethod
     def create_malicious_file(filename: str = "malicious.jpg") -> FileStorage:
         """Create a file with malicious content for testing"""
-        # PE executable header disguised as image
-        malicious_data = b'\x4d\x5a' + b'\x00' * 1022  # PE header + padding
-        
-        file_obj = BytesIO(malicious_data)
-        return FileStorage(
-            stream=file_obj,
-            filename=filename,
-            content_type='image/jpeg'
-        )
+        return FileSecurityTester.make_jpeg(filename, malicious=True)
     
     @staticmethod
     def create_oversized_file(filename: str = "large.jpg", size: int = None) -> FileStorage:
         """Create an oversized file for testing"""
-        if size is None:
-            size = file_handler.max_file_size + 1024  # Slightly over limit
-        
-        jpeg_header = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x01\x00H\x00H\x00\x00\xff\xdb\x00C\x00'
-        large_data = jpeg_header + b'\x00' * (size - len(jpeg_header) - 2) + b'\xff\xd9'
-        
-        file_obj = BytesIO(large_data)
-        return FileStorage(
-            stream=file_obj,
-            filename=filename,
-            content_type='image/jpeg'
-        )
+        return FileSecurityTester.make_jpeg(filename, size, oversized=True)
+    
+    # (result key, factory) pairs exercised by test_file_validation
+    VALIDATION_SCENARIOS = [
+        ('valid_file', lambda: FileSecurityTester.create_test_image("valid.jpg")),
+        ('malicious_file', lambda: FileSecurityTester.create_malicious_file("malicious.jpg")),
+        ('oversized_file', lambda: FileSecurityTester.create_oversized_file("large.jpg")),
+        ('dangerous_extension', lambda: FileSecurityTester.create_test_image("script.php.jpg")),
+        ('directory_traversal', lambda: FileSecurityTester.create_test_image("../../../etc/passwd.jpg")),
+    ]
     
     @staticmethod
-    def test_file_validation() -> Dict[str, Any]:
-        """Test file validation with various scenarios"""
-        results = {}
-        
-        # Test valid file
+    def _validate_scenario(factory) -> Dict[str, Any]:
+        """Validate the upload built by factory, reporting any exception as an error"""
         try:
-            valid_file = FileSecurityTester.create_test_image("valid.jpg")
-            result = file_handler.validate_upload(valid_file)
-            results['valid_file'] = {
-                'is_valid': result.is_valid,
-                'errors': result.errors,
-                'warnings': result.warnings
-            }
-        except Exception as e:
-            results['valid_file'] = {'error': str(e)}
-        
-        # Test malicious file
-        try:
-            malicious_file = FileSecurityTester.create_malicious_file("malicious.jpg")
-            result = file_handler.validate_upload(malicious_file)
-            results['malicious_file'] = {
-                'is_valid': result.is_valid,
-                'errors': result.errors,
-                'warnings': result.warnings
-            }
-        except Exception as e:
-            results['malicious_file'] = {'error': str(e)}
-        
-        # Test oversized file
-        try:
-            oversized_file = FileSecurityTester.create_oversized_file("large.jpg")
-            result = file_handler.validate_upload(oversized_file)
-            results['oversized_file'] = {
-                'is_valid': result.is_valid,
-                'errors': result.errors,
-                'warnings': result.warnings
-            }
-        except Exception as e:
-            results['oversized_file'] = {'error': str(e)}
-        
-        # Test dangerous extension
-        try:
-            dangerous_file = FileSecurityTester.create_test_image("script.php.jpg")
-            result = file_handler.validate_upload(dangerous_file)
-            results['dangerous_extension'] = {
-                'is_valid': result.is_valid,
-                'errors': result.errors,
-                'warnings': result.warnings
-            }
-        except Exception as e:
-            results['dangerous_extension'] = {'error': str(e)}
-        
-        # Test directory traversal
-        try:
-            traversal_file = FileSecurityTester.create_test_image("../../../etc/passwd.jpg")
-            result = file_handler.validate_upload(traversal_file)
-            results['directory_traversal'] = {
+            result = file_handler.validate_upload(factory())
+            return {
                 'is_valid': result.is_valid,
                 'errors': result.errors,
                 'warnings': result.warnings
             }
         except Exception as e:
-            results['directory_traversal'] = {'error': str(e)}
-        
-        return results
+            return {'error': str(e)}
+    
+    @staticmethod
+    def test_file_validation() -> Dict[str, Any]:
+        """Test file validation with various scenarios"""
+        return {
+            name: FileSecurityTester._validate_scenario(factory)
+            for name, factory in FileSecurityTester.VALIDATION_SCENARIOS
+        }
 
 
 class FileSystemMonitor:
@@ -152,27 +231,39 @@ class FileSystemMonitor:
         }
         
         try:
-            # Scan all files in upload directory
-            for file_path in self.upload_directory.rglob('*'):
-                if file_path.is_file():
-                    results['total_files'] += 1
-                    
-                    # Check file info
-                    file_info = file_handler.get_file_info(file_path)
-                    
+            # Scan all files in upload directory. Only the malware scan and
+            # the size are needed, so the full get_file_info (which also
+            # hashes the whole file) is skipped and the size comes from the
+            # directory entry
+            paths = []
+            stats = []
+            for entry in _iter_files(self.upload_directory):
+                paths.append(entry.path)
+                stats.append(entry.stat(follow_symlinks=False))
+            results['total_files'] = len(paths)
+            
+            # The scans are file reads that release the GIL, so they run in
+            # a thread pool; unchanged files reuse their cached result
+            with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+                scans = executor.map(
+                    _scan_file, paths,
+                    [stat.st_mtime_ns for stat in stats],
+                    [stat.st_size for stat in stats]
+                )
+                
+                for path, stat, is_safe in zip(paths, stats, scans):
                     # Check if file is suspicious
-                    if not file_info.get('is_safe', True):
+                    if not is_safe:
                         results['suspicious_files'].append({
-                            'path': str(file_path),
+                            'path': path,
                             'reason': 'Failed malware scan'
                         })
                     
                     # Check for large files
-                    file_size = file_info.get('size', 0)
-                    if file_size > file_handler.max_file_size:
+                    if stat.st_size > file_handler.max_file_size:
                         results['large_files'].append({
-                            'path': str(file_path),
-                            'size': file_size
+                            'path': path,
+                            'size': stat.st_size
                         })
             
             # Count quarantined files
@@ -187,37 +278,46 @@ class FileSystemMonitor:
         return results
     
     def cleanup_old_files(self, days: int = 30) -> Dict[str, Any]:
-        """Clean up old files from upload directory"""
-        from datetime import datetime, timedelta
-        
+        """Clean up old files from upload directory, unlinking them on a bounded thread pool"""
         results = {
             'deleted_files': 0,
             'errors': []
         }
         
         try:
-            cutoff_date = datetime.now() - timedelta(days=days)
+            cutoff = (datetime.now() - timedelta(days=days)).timestamp()
             
-            for file_path in self.upload_directory.rglob('*'):
-                if file_path.is_file():
-                    # Skip quarantine directory
-                    if 'quarantine' in file_path.parts:
-                        continue
-                    
-                    try:
-                        mod_time = datetime.fromtimestamp(file_path.stat().st_mtime)
-                        if mod_time < cutoff_date:
-                            file_path.unlink()
-                            results['deleted_files'] += 1
-                            logger.info(f"Deleted old file: {file_path}")
-                    except Exception as e:
-                        results['errors'].append(f"Failed to delete {file_path}: {e}")
+            candidates = []
+            for entry in _iter_files(self.upload_directory):
+                # Skip quarantine directory
+                if 'quarantine' in Path(entry.path).parts:
+                    continue
+                
+                try:
+                    if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                        candidates.append(entry.path)
+                except OSError as e:
+                    results['errors'].append(f"Failed to delete {entry.path}: {e}")
+            
+            # The unlinks overlap on a fixed number of threads instead of
+            # running one after another
+            with ThreadPoolExecutor(max_workers=CLEANUP_WORKERS) as executor:
+                for path, error in zip(candidates, executor.map(_unlink, candidates)):
+                    if error is not None:
+                        results['errors'].append(f"Failed to delete {path}: {error}")
+                    else:
+                        results['deleted_files'] += 1
+                        logger.info(f"Deleted old file: {path}")
         
         except Exception as e:
             logger.error(f"Cleanup error: {e}")
             results['error'] = str(e)
         
         return results
+    
+    async def cleanup_old_files_async(self, days: int = 30) -> Dict[str, Any]:
+        """Clean up old files from upload directory without blocking the event loop"""
+        return await asyncio.to_thread(self.cleanup_old_files, days)
 
 
 class FileUploadHelper: